@@ -0,0 +1,496 @@
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from decouple import config
+from PIL import Image, ImageDraw
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+import extract_tutorial_steps
+from utils import data_utils
+from utils import LocalStorage
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_DIR = config("BENCHMARK_DIR", default=".cache/benchmark")
+BASELINE_PATH = "benchmark_baseline.json"
+
+STAGES = ["book", "post", "extract"]
+METRICS = ["wall_s", "peak_rss_mb", "output_bytes"]
+
+# Step images are the size of a tutorial cell rendered at the extraction DPI
+STEP_SIZE = (
+    round(extract_tutorial_steps.WIDTH / 72 * extract_tutorial_steps.DPI),
+    round(extract_tutorial_steps.HEIGHT / 72 * extract_tutorial_steps.DPI),
+)
+STEPS_PER_PAGE = 9
+
+
+def carry_rows(scale, sample, seed):
+    """
+    Generate the carries.json rows of a synthetic workspace.
+
+    The first scale rows have a tutorial and make up the book. The last sample
+    rows do not yet, their tutorials are extracted by the extract stage.
+
+    Parameters:
+    - scale: int, number of carries in the book
+    - sample: int, number of tutorials to extract
+    - seed: int, seed of the random generator
+
+    Returns:
+    - list, rows that load as data_utils.Carry through LocalStorage
+    """
+    rng = random.Random(seed)
+    rows = []
+    for i in range(scale + sample):
+        tutorial = i < scale
+        name = f"bench_{i:04}" if tutorial else f"bench_tutorial_{i - scale:04}"
+        rows.append(
+            {
+                "name": name,
+                "longtitle": f"Benchmark Carry {i} {rng.choice(data_utils.FINISHES)}",
+                "mmposition": rng.choice(list(data_utils.MMPOSITIONS)),
+                "position": rng.choice(["front", "back"]),
+                "size": rng.randint(-2, 2),
+                "difficulty": rng.randint(1, 5),
+                "tutorial": tutorial,
+            }
+        )
+    return rows
+
+
+def _scribble(rng, width, height):
+    """Random strokes, each as (points, gray level, stroke width) in a box."""
+    strokes = []
+    for _ in range(rng.randint(8, 16)):
+        points = [
+            (rng.uniform(0.1, 0.9) * width, rng.uniform(0.1, 0.9) * height)
+            for _ in range(rng.randint(2, 5))
+        ]
+        strokes.append((points, rng.randint(0, 160), rng.randint(2, 8)))
+    return strokes
+
+
+def step_image(rng, number):
+    """
+    Draw a synthetic step image: gray strokes, a colored accent and a number.
+
+    Parameters:
+    - rng: random.Random, generator for the strokes
+    - number: int, step number written in the corner
+
+    Returns:
+    - PIL.Image, RGB image of STEP_SIZE
+    """
+    width, height = STEP_SIZE
+    image = Image.new("RGB", STEP_SIZE, "white")
+    draw = ImageDraw.Draw(image)
+    for points, gray, stroke_width in _scribble(rng, width, height):
+        draw.line(points, fill=(gray, gray, gray), width=stroke_width)
+
+    x, y = rng.uniform(0.2, 0.6) * width, rng.uniform(0.2, 0.6) * height
+    color = tuple(rng.randint(0, 255) for _ in range(3))
+    draw.ellipse((x, y, x + width * 0.2, y + width * 0.2), outline=color, width=6)
+    draw.text((20, 20), str(number), fill="black")
+    return image
+
+
+def cover_svg(rng):
+    """
+    Generate a synthetic cover in the format of covers/, drawn in ff0000.
+
+    Parameters:
+    - rng: random.Random, generator for the shapes
+
+    Returns:
+    - str, the SVG document
+    """
+    paths = []
+    for points, _, stroke_width in _scribble(rng, 187, 259):
+        d = "M " + " L ".join(f"{x:.1f},{y:.1f}" for x, y in points)
+        paths.append(
+            f'  <path d="{d}" fill="none" stroke="#ff0000" '
+            f'stroke-width="{stroke_width / 4}" />'
+        )
+    return (
+        '<svg width="187mm" height="259mm" viewBox="0 0 187 259" '
+        'xmlns="http://www.w3.org/2000/svg">\n' + "\n".join(paths) + "\n</svg>\n"
+    )
+
+
+def write_tutorial(path, steps, rng):
+    """
+    Write a synthetic tutorial PDF with steps laid out in the extraction grid.
+
+    Parameters:
+    - path: str, where to write the PDF
+    - steps: int, number of steps, the last page leaves the remaining cells blank
+    - rng: random.Random, generator for the strokes
+    """
+    c = canvas.Canvas(path, pagesize=A4)
+    for first in range(0, steps, STEPS_PER_PAGE):
+        for k in range(first, min(steps, first + STEPS_PER_PAGE)):
+            i, j = (k - first) % 3, (k - first) // 3
+            left, top, right, bottom = extract_tutorial_steps.cell_box(i, j)
+            width, height = right - left, top - bottom
+
+            c.rect(left + 6, bottom + 6, width - 12, height - 12)
+            for points, gray, stroke_width in _scribble(rng, width, height):
+                c.setStrokeGray(gray / 255)
+                c.setLineWidth(stroke_width / 4)
+                path = c.beginPath()
+                path.moveTo(left + points[0][0], bottom + points[0][1])
+                for x, y in points[1:]:
+                    path.lineTo(left + x, bottom + y)
+                c.drawPath(path)
+            c.setStrokeGray(0)
+            c.drawString(left + 12, top - 20, f"Step {k + 1}")
+        c.showPage()
+    c.save()
+
+
+def prepare_workspace(scale, steps, sample, seed):
+    """
+    Create the synthetic data for a scale, unless it was created before.
+
+    The workspace holds covers/, tutorials/ and a storage/ snapshot for
+    STORAGE_BACKEND=local, with steps PNGs for every carry in the book.
+
+    Parameters:
+    - scale: int, number of carries in the book
+    - steps: int, number of steps of each carry
+    - sample: int, number of posts generated and tutorials extracted
+    - seed: int, seed of the random generator
+
+    Returns:
+    - str, path of the workspace
+    """
+    workspace = os.path.join(
+        REPO_DIR, BENCHMARK_DIR, f"{scale}-{steps}-{sample}-{seed}"
+    )
+    marker = os.path.join(workspace, "workspace.json")
+    if os.path.exists(marker):
+        return workspace
+
+    shutil.rmtree(workspace, ignore_errors=True)
+    storage = LocalStorage.LocalStorage(os.path.join(workspace, "storage"))
+    os.makedirs(storage.steps_dir)
+    os.makedirs(os.path.join(workspace, "covers"))
+    os.makedirs(os.path.join(workspace, "tutorials"))
+
+    # Fonts are loaded from paths relative to the working directory
+    os.symlink(os.path.join(REPO_DIR, "fonts"), os.path.join(workspace, "fonts"))
+
+    print(f"Generating {scale} carries with {steps} steps in {workspace}")
+    rng = random.Random(seed)
+    for row in carry_rows(scale, sample, seed):
+        name = row["name"]
+        if row["tutorial"]:
+            for number in range(1, steps + 1):
+                step_image(rng, number).save(
+                    os.path.join(storage.steps_dir, f"{name}_step{number:02}.png")
+                )
+            with open(os.path.join(workspace, "covers", f"{name}.svg"), "w") as f:
+                f.write(cover_svg(rng))
+        else:
+            write_tutorial(
+                os.path.join(workspace, "tutorials", f"{name}.pdf"), steps, rng
+            )
+
+    with open(marker, "w") as f:
+        json.dump({"scale": scale, "steps": steps, "sample": sample, "seed": seed}, f)
+    return workspace
+
+
+def reset_workspace(workspace):
+    """Undo what a previous run changed: outputs, extracted steps, flags."""
+    with open(os.path.join(workspace, "workspace.json")) as f:
+        params = json.load(f)
+
+    storage = LocalStorage.LocalStorage(os.path.join(workspace, "storage"))
+    storage.save_carry_rows(
+        carry_rows(params["scale"], params["sample"], params["seed"])
+    )
+    for entry in os.scandir(storage.steps_dir):
+        if entry.name.startswith("bench_tutorial_"):
+            os.remove(entry.path)
+
+    # steps/ is left behind by an extraction that failed halfway
+    for dirname in ["output", "steps", ".cache"]:
+        shutil.rmtree(os.path.join(workspace, dirname), ignore_errors=True)
+
+
+def directory_size(path, prefix=""):
+    """Total size in bytes of the files in a directory tree, by name prefix."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            if name.startswith(prefix):
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and its finished workers, in MiB."""
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    unit = 1 if sys.platform == "darwin" else 1024
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return peak * unit / 1024 / 1024
+
+
+def run_stage(stage, sample, workers):
+    """
+    Run one stage in the current directory, which must be a workspace.
+
+    Meant to run in its own process, with STORAGE_BACKEND=local, so the peak
+    memory is that of the stage alone.
+
+    Parameters:
+    - stage: str, one of STAGES
+    - sample: int, number of posts to generate or tutorials to extract
+    - workers: int, processes used by the book and the extraction
+
+    Returns:
+    - dict, wall time in seconds, peak RSS in MiB and bytes written
+    """
+    from utils import BookGenerator
+    from utils import PostGenerator
+    from utils import db_utils
+
+    start = time.perf_counter()
+    if stage == "book":
+        generator = BookGenerator.BookGenerator()
+        generator.create_combined_pdf(
+            output_path="output",
+            output_filename="book.pdf",
+            carries=db_utils.load_book_data(),
+            workers=workers,
+        )
+        output_bytes = directory_size("output")
+    elif stage == "post":
+        for carry in db_utils.get_carries()[:sample]:
+            generator = PostGenerator.PostGenerator(
+                os.path.join("output", "posts"), carry
+            )
+            generator.generate_post()
+        output_bytes = directory_size("output")
+    else:
+        tutorials = sorted(os.listdir("tutorials"))[:sample]
+        for filename in tutorials:
+            extract_tutorial_steps.extract_steps_to_png(
+                "tutorials", os.path.splitext(filename)[0], workers=workers
+            )
+        output_bytes = directory_size(
+            db_utils.get_storage().steps_dir, "bench_tutorial_"
+        )
+    wall_s = time.perf_counter() - start
+
+    return {
+        "wall_s": wall_s,
+        "peak_rss_mb": peak_rss_mb(),
+        "output_bytes": output_bytes,
+    }
+
+
+def measure_stage(stage, workspace, sample, workers):
+    """
+    Run a stage in a fresh interpreter inside a workspace and collect its result.
+
+    Parameters:
+    - stage: str, one of STAGES
+    - workspace: str, path returned by prepare_workspace
+    - sample: int, number of posts to generate or tutorials to extract
+    - workers: int, processes used by the book and the extraction
+
+    Returns:
+    - dict, as returned by run_stage, or with an error and the log path
+    """
+    reset_workspace(workspace)
+    result_path = os.path.join(workspace, f"{stage}.json")
+    log_path = os.path.join(workspace, f"{stage}.log")
+    env = dict(
+        os.environ,
+        STORAGE_BACKEND="local",
+        LOCAL_STORAGE_DIR=os.path.join(workspace, "storage"),
+    )
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--stage",
+        stage,
+        "--sample",
+        str(sample),
+        "--workers",
+        str(workers),
+        "--result",
+        result_path,
+    ]
+
+    with open(log_path, "w") as log:
+        process = subprocess.run(
+            command, cwd=workspace, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+    if process.returncode != 0:
+        return {"error": f"exit status {process.returncode}, see {log_path}"}
+
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with a baseline and print the relative change of each metric.
+
+    Parameters:
+    - results: dict, results by "stage@scale"
+    - baseline: dict, earlier results in the same format
+    - tolerance: float, relative increase above which a metric regressed
+
+    Returns:
+    - bool, True if no metric regressed
+    """
+    ok = True
+    for key, result in results.items():
+        base = baseline.get(key)
+        if "error" in result or base is None:
+            continue
+        for metric in METRICS:
+            if not base[metric]:
+                continue
+            change = result[metric] / base[metric] - 1
+            regressed = change > tolerance
+            ok = ok and not regressed
+            status = "REGRESSED" if regressed else "ok"
+            print(
+                f"{key} {metric}: {result[metric]:.2f} vs {base[metric]:.2f} "
+                f"({change:+.1%}) {status}"
+            )
+    return ok
+
+
+def main(args):
+    results = {}
+    for scale in args.scales:
+        sample = min(args.sample, scale)
+        workspace = prepare_workspace(scale, args.steps, sample, args.seed)
+
+        for stage in args.stages:
+            key = f"{stage}@{scale}"
+            # Keep the fastest run, as the others were disturbed by something
+            runs = [
+                measure_stage(stage, workspace, sample, args.workers)
+                for _ in range(args.runs)
+            ]
+            measured = [run for run in runs if "error" not in run]
+            results[key] = (
+                min(measured, key=lambda run: run["wall_s"]) if measured else runs[0]
+            )
+
+            result = results[key]
+            if "error" in result:
+                print(f"{key}: failed, {result['error']}")
+            else:
+                print(
+                    f"{key}: {result['wall_s']:.2f} s, "
+                    f"peak RSS {result['peak_rss_mb']:.0f} MiB, "
+                    f"output {result['output_bytes'] / 1024:.0f} KiB"
+                )
+
+    failed = any("error" in result for result in results.values())
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+
+    ok = compare(results, baseline, args.tolerance) if baseline else True
+
+    if args.save_baseline:
+        baseline.update(
+            (key, result) for key, result in results.items() if "error" not in result
+        )
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+
+    return ok and not failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the book, posts and step extraction on synthetic data"
+    )
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=[10],
+        help="Numbers of carries to benchmark with, e.g. 10 100 1000",
+    )
+    parser.add_argument(
+        "--steps", type=int, default=12, help="Number of steps of each carry"
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=10,
+        help="Number of posts generated and tutorials extracted",
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=STAGES,
+        default=STAGES,
+        help="Stages to benchmark",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes used by the book and the extraction",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=1,
+        help="Runs per stage, the fastest one is kept",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=BASELINE_PATH,
+        help="JSON file with the results to compare against",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store the results in the baseline file",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Relative increase of a metric that counts as a regression",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the synthetic data"
+    )
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--result", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        result = run_stage(args.stage, args.sample, args.workers)
+        with open(args.result, "w") as f:
+            json.dump(result, f)
+    else:
+        sys.exit(0 if main(args) else 1)
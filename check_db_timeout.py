@@ -0,0 +1,70 @@
+import argparse
+import os
+import time
+from utils import db_utils
+
+
+class _HungQuery:
+    """Stands in for a carries query whose server never answers."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def execute(self):
+        time.sleep(self.seconds)
+
+
+def check_timeout(timeout, slack):
+    """
+    Check that a synchronous wrapper gives up on a hung request in time.
+
+    get_carries is called with a query that hangs for longer than the timeout.
+    It must raise TimeoutError within timeout + slack seconds, rather than
+    waiting for the request to finish.
+
+    Parameters:
+    - timeout: float, DB_TIMEOUT to check with, in seconds
+    - slack: float, seconds the wrapper may take on top of the timeout
+
+    Returns:
+    - bool, True if the wrapper returned in time
+    """
+    db_utils.STORAGE_BACKEND = "supabase"
+    db_utils.DB_TIMEOUT = timeout
+    db_utils._carries_query = lambda: _HungQuery(timeout + slack + 5)
+
+    start = time.perf_counter()
+    try:
+        db_utils.get_carries()
+        print("get_carries returned although the request hung")
+        return False
+    except TimeoutError:
+        elapsed = time.perf_counter() - start
+
+    within = elapsed <= timeout + slack
+    status = "ok" if within else "TOO SLOW"
+    print(
+        f"get_carries: gave up after {elapsed:.1f} s (DB_TIMEOUT {timeout} s) {status}"
+    )
+    return within
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that database calls give up after DB_TIMEOUT"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=1, help="DB_TIMEOUT to check with"
+    )
+    parser.add_argument(
+        "--slack",
+        type=float,
+        default=1,
+        help="Seconds the call may take on top of the timeout",
+    )
+    args = parser.parse_args()
+
+    ok = check_timeout(args.timeout, args.slack)
+
+    # Do not wait for the hung request's thread on the way out
+    os._exit(0 if ok else 1)
@@ -0,0 +1,75 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# Milliseconds each entry point may spend importing, measured in a fresh
+# interpreter. Heavy dependencies (supabase, cairosvg, pdf2image, pypdf for
+# book stitching) are imported where they are used, so they do not count here.
+BUDGETS_MS = {
+    "generate_book": 500,
+    "generate_post": 500,
+    "extract_tutorial_steps": 300,
+}
+
+
+def measure_import_time(module):
+    """
+    Measure how long importing a module takes in a fresh interpreter.
+
+    Parameters:
+    - module: str, name of the module to import
+
+    Returns:
+    - float, cumulative import time in milliseconds as reported by -X importtime
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # The module itself is reported last, after everything it imported
+    for line in reversed(result.stderr.splitlines()):
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000
+
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+def check_budgets(runs):
+    """
+    Check every entry point against its import-time budget.
+
+    Parameters:
+    - runs: int, imports per entry point, the fastest one is kept
+
+    Returns:
+    - bool, True if every entry point is within budget
+    """
+    ok = True
+    for module, budget in BUDGETS_MS.items():
+        elapsed = min(measure_import_time(module) for _ in range(runs))
+        within = elapsed <= budget
+        ok = ok and within
+        status = "ok" if within else "OVER BUDGET"
+        print(f"{module}: {elapsed:.0f} ms (budget {budget} ms) {status}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the import time of the entry points against a budget"
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=5,
+        help="Imports per entry point, the fastest one is compared to the budget",
+    )
+    args = parser.parse_args()
+
+    sys.exit(0 if check_budgets(args.runs) else 1)
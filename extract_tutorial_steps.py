@@ -1,9 +1,11 @@
 import argparse
+import io
+import queue
 import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from pypdf import PdfReader, PdfWriter
-from pdf2image import convert_from_path
 import os
-import numpy as np
 from utils import image_utils
 from utils import db_utils
 
@@ -13,57 +15,288 @@ STARTX = 24
 STARTY = 693
 BUFFERX = 24
 
+DPI = 300
+# Resolution of a cheap blank check before rendering at DPI, 0 to skip it. The
+# check costs an extra render per page (per cell in cells mode) and only saves
+# work on pages or cells that turn out blank, so it is off by default.
+PROBE_DPI = 0
+# A cell is blank if no pixel is darker than 255 - tolerance. 0 only skips pure
+# white cells, a higher tolerance also skips faint ones, which ends a row early
+BLANK_TOLERANCE = 0
+POPPLER_PATH = "/opt/homebrew/bin/"
 
-def extract_steps_to_png(tutorial_dir, carryname):
-    pdf_filename = f"{carryname}.pdf"
-    input_pdf_path = os.path.join(tutorial_dir, pdf_filename)
 
-    counter = 1
-    pdf_reader = PdfReader(input_pdf_path)
-    num_pages = len(pdf_reader.pages)
+def render_cell(pdf_path, dpi):
+    from pdf2image import convert_from_path
 
-    filepaths = []
-    if not os.path.exists("steps"):
-        os.makedirs("steps")
+    return convert_from_path(pdf_path, dpi=dpi, poppler_path=POPPLER_PATH)[0]
+
+
+def render_page(pdf_path, page_index, dpi):
+    from pdf2image import convert_from_path
+
+    return convert_from_path(
+        pdf_path,
+        dpi=dpi,
+        first_page=page_index + 1,
+        last_page=page_index + 1,
+        poppler_path=POPPLER_PATH,
+    )[0]
+
+
+def render_step(
+    pdf_path, dpi=DPI, blank_tolerance=BLANK_TOLERANCE, probe_dpi=PROBE_DPI
+):
+    """
+    Render a cell as a step image, unless it is empty.
 
-    for m in range(num_pages):
+    If probe_dpi is set, the cell is first rendered at that resolution. A probe
+    that is pure white means the cell is blank and the full render is skipped.
 
-        page = pdf_reader.pages[m]
+    Args:
+        pdf_path (str): One-page PDF cropped to the cell
+        dpi (int): Resolution of the final step image
+        blank_tolerance (int): Whiteness tolerance for the full resolution check
+        probe_dpi (int): Resolution of the first check, 0 to disable it
 
-        for j in range(0, 3):
-            for i in range(0, 3):
+    Returns:
+        PIL.Image: The step image, or None if the cell is blank
+    """
+    if probe_dpi and image_utils.is_blank(render_cell(pdf_path, probe_dpi)):
+        return None
 
-                page.mediabox.upper_left = [
-                    STARTX + i * (WIDTH + BUFFERX),
-                    STARTY - j * HEIGHT,
-                ]
-                page.mediabox.lower_right = [
-                    STARTX + (i + 1) * WIDTH + i * BUFFERX,
-                    STARTY - (j + 1) * HEIGHT,
-                ]
+    image = render_cell(pdf_path, dpi)
+    if image_utils.is_blank(image, blank_tolerance):
+        return None
 
-                pdf_writer = PdfWriter()
-                pdf_writer.add_page(page)
+    return image
 
-                step_pdf_filename = f"{carryname}_{counter}.pdf"
-                pdf_writer.write(step_pdf_filename)
 
-                image = convert_from_path(
-                    step_pdf_filename, dpi=300, poppler_path="/opt/homebrew/bin/"
-                )[0]
+def cell_box(i, j):
+    """
+    Get the PDF coordinates of a cell in the 3x3 tutorial grid.
 
-                os.remove(step_pdf_filename)
+    Args:
+        i (int): Column of the cell (0-2)
+        j (int): Row of the cell from the top (0-2)
 
-                pixels = np.array(list(image.getdata()))
-                unique = np.unique(pixels, return_counts=False)
-                if len(unique) == 1:
+    Returns:
+        tuple: (left, top, right, bottom) in points
+    """
+    return (
+        STARTX + i * (WIDTH + BUFFERX),
+        STARTY - j * HEIGHT,
+        STARTX + (i + 1) * WIDTH + i * BUFFERX,
+        STARTY - (j + 1) * HEIGHT,
+    )
+
+
+def crop_cell(image, page_box, cell, dpi):
+    """
+    Crop a cell out of a page rendered at the given DPI.
+
+    Args:
+        image (PIL.Image): The rendered page
+        page_box: Box the page was rendered from (pypdf RectangleObject)
+        cell (tuple): (left, top, right, bottom) of the cell in points
+        dpi (int): Resolution the page was rendered at
+
+    Returns:
+        PIL.Image: The cell
+    """
+    scale = dpi / 72
+    left, top, right, bottom = cell
+    return image.crop(
+        (
+            round((left - float(page_box.left)) * scale),
+            round((float(page_box.top) - top) * scale),
+            round((right - float(page_box.left)) * scale),
+            round((float(page_box.top) - bottom) * scale),
+        )
+    )
+
+
+def iter_page_steps(
+    pdf_path,
+    page_index,
+    page_box,
+    dpi=DPI,
+    blank_tolerance=BLANK_TOLERANCE,
+    probe_dpi=PROBE_DPI,
+):
+    """
+    Render a tutorial page once and yield the steps cropped from its grid.
+
+    A blank cell ends its row, as in iter_page_steps_by_cell.
+
+    Args:
+        pdf_path (str): Path to the tutorial PDF
+        page_index (int): Zero-based index of the page
+        page_box: Box the page is rendered from (pypdf RectangleObject)
+        dpi (int): Resolution of the step images
+        blank_tolerance (int): Whiteness tolerance for the full resolution check
+        probe_dpi (int): Resolution of the first blank check, 0 to disable it
+
+    Yields:
+        PIL.Image: Step images in reading order
+    """
+    cells = [[cell_box(i, j) for i in range(0, 3)] for j in range(0, 3)]
+
+    # Skip the full resolution render if the probe finds nothing at all
+    candidates = cells
+    if probe_dpi:
+        probe = render_page(pdf_path, page_index, probe_dpi)
+        candidates = []
+        for row in cells:
+            kept = []
+            for cell in row:
+                if image_utils.is_blank(crop_cell(probe, page_box, cell, probe_dpi)):
                     break
+                kept.append(cell)
+            candidates.append(kept)
+
+        if not any(candidates):
+            return
+
+    image = render_page(pdf_path, page_index, dpi)
+    for row in candidates:
+        for cell in row:
+            step = crop_cell(image, page_box, cell, dpi)
+            if image_utils.is_blank(step, blank_tolerance):
+                break
+            yield step
+
+
+def iter_page_steps_by_cell(
+    page,
+    carryname,
+    dpi=DPI,
+    blank_tolerance=BLANK_TOLERANCE,
+    probe_dpi=PROBE_DPI,
+):
+    """
+    Yield the steps of a tutorial page, rendering each cell as its own PDF.
+
+    Args:
+        page: pypdf page to crop the cells from
+        carryname (str): Name of the carry, used for temporary file names
+        dpi (int): Resolution of the step images
+        blank_tolerance (int): Whiteness tolerance for the full resolution check
+        probe_dpi (int): Resolution of the first blank check, 0 to disable it
+
+    Yields:
+        PIL.Image: Step images in reading order
+    """
+    for j in range(0, 3):
+        for i in range(0, 3):
+            left, top, right, bottom = cell_box(i, j)
+            page.mediabox.upper_left = [left, top]
+            page.mediabox.lower_right = [right, bottom]
+
+            pdf_writer = PdfWriter()
+            pdf_writer.add_page(page)
+
+            step_pdf_filename = f"{carryname}_cell_{os.getpid()}.pdf"
+            pdf_writer.write(step_pdf_filename)
+
+            image = render_step(step_pdf_filename, dpi, blank_tolerance, probe_dpi)
+
+            os.remove(step_pdf_filename)
+
+            if image is None:
+                break
+
+            yield image
+
+
+def extract_page_steps(
+    pdf_path,
+    page_index,
+    carryname,
+    dpi=DPI,
+    blank_tolerance=BLANK_TOLERANCE,
+    probe_dpi=PROBE_DPI,
+    mode="page",
+):
+    """
+    Extract the steps of one tutorial page as PNG data.
+
+    Runs in a worker process, so it opens the PDF itself and returns encoded
+    images rather than PIL objects.
+
+    Args:
+        pdf_path (str): Path to the tutorial PDF
+        page_index (int): Zero-based index of the page
+        carryname (str): Name of the carry
+        dpi (int): Resolution of the step images
+        blank_tolerance (int): Whiteness tolerance for the full resolution check
+        probe_dpi (int): Resolution of the first blank check, 0 to disable it
+        mode (str): "page" to render the page once, "cells" to render each cell
+
+    Returns:
+        list: PNG data of each step on the page, in reading order
+    """
+    page = PdfReader(pdf_path).pages[page_index]
+
+    if mode == "cells":
+        steps = iter_page_steps_by_cell(
+            page, carryname, dpi, blank_tolerance, probe_dpi
+        )
+    else:
+        steps = iter_page_steps(
+            pdf_path, page_index, page.cropbox, dpi, blank_tolerance, probe_dpi
+        )
+
+    pngs = []
+    for image in steps:
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG")
+        pngs.append(buffer.getvalue())
+    return pngs
+
+
+def extract_steps_to_png(
+    tutorial_dir,
+    carryname,
+    dpi=DPI,
+    blank_tolerance=BLANK_TOLERANCE,
+    probe_dpi=PROBE_DPI,
+    mode="page",
+    workers=None,
+):
+    pdf_filename = f"{carryname}.pdf"
+    input_pdf_path = os.path.join(tutorial_dir, pdf_filename)
+
+    counter = 1
+    pdf_reader = PdfReader(input_pdf_path)
+    num_pages = len(pdf_reader.pages)
 
+    filepaths = []
+    if not os.path.exists("steps"):
+        os.makedirs("steps")
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=min(workers, max(1, num_pages))) as executor:
+        # map returns pages in order, so step numbers stay contiguous
+        pages = executor.map(
+            extract_page_steps,
+            [input_pdf_path] * num_pages,
+            range(num_pages),
+            [carryname] * num_pages,
+            [dpi] * num_pages,
+            [blank_tolerance] * num_pages,
+            [probe_dpi] * num_pages,
+            [mode] * num_pages,
+        )
+
+        for pngs in pages:
+            for png in pngs:
                 step_png_path = f"{carryname}_step{str(counter).zfill(2)}.png"
                 step_png_filename = os.path.split(step_png_path)[-1]
 
                 new_path = os.path.join("steps", step_png_filename)
-                image.save(new_path, "PNG")
+                with open(new_path, "wb") as f:
+                    f.write(png)
 
                 filepaths.append(os.path.join(new_path))
 
@@ -81,6 +314,228 @@ def extract_steps_to_png(tutorial_dir, carryname):
         shutil.rmtree("steps")
 
 
+def extract_all_tutorials(
+    tutorial_dir,
+    dpi=DPI,
+    blank_tolerance=BLANK_TOLERANCE,
+    probe_dpi=PROBE_DPI,
+    mode="page",
+    workers=None,
+    upload_workers=db_utils.UPLOAD_WORKERS,
+    queue_size=None,
+):
+    """
+    Extract, upload and publish the steps of every tutorial in a directory.
+
+    Runs as a streaming pipeline. Pages are rendered, cropped, checked for
+    blanks and encoded in a process pool, numbered in order, uploaded by a
+    pool of threads, and each carry is marked as having a tutorial once all
+    its steps are uploaded. Stages are connected by bounded queues, so memory
+    use does not grow with the number of tutorials and nothing is written to
+    disk.
+
+    Args:
+        tutorial_dir (str): Directory with one {carryname}.pdf per tutorial
+        dpi (int): Resolution of the step images
+        blank_tolerance (int): Whiteness tolerance for the full resolution check
+        probe_dpi (int): Resolution of the first blank check, 0 to disable it
+        mode (str): "page" to render the page once, "cells" to render each cell
+        workers (int, optional): Number of processes, defaults to the CPU count
+        upload_workers (int): Number of concurrent uploads
+        queue_size (int, optional): Capacity of each queue between stages,
+            defaults to twice the number of processes
+
+    Returns:
+        dict: Lists of carry names that were published and that failed
+    """
+    carrynames = sorted(
+        os.path.splitext(f)[0]
+        for f in os.listdir(tutorial_dir)
+        if f.lower().endswith(".pdf")
+    )
+
+    workers = workers or os.cpu_count() or 1
+    queue_size = queue_size or 2 * workers
+    upload_workers = max(1, upload_workers)
+
+    pages_queue = queue.Queue(maxsize=queue_size)
+    uploads_queue = queue.Queue(maxsize=queue_size)
+    finished_queue = queue.Queue(maxsize=queue_size)
+
+    existing_names = {item["name"] for item in db_utils.list_bucket()}
+
+    # Steps expected, done and failed per carry, shared by the stages below
+    progress = {
+        carryname: {"expected": None, "done": 0, "failed": False, "reported": False}
+        for carryname in carrynames
+    }
+    progress_lock = threading.Lock()
+    summary = {"published": [], "failed": []}
+    errors = []
+
+    def guarded(stage, inbox=None, outbox=None, sentinels=1):
+        """
+        Wrap a stage so that its failure cannot leave the others blocked.
+
+        Whatever happens, the stage ends its output with sentinels. If it
+        fails, the error is kept for the main thread and its input is drained,
+        so the stage before it does not block on a full queue.
+        """
+
+        def run():
+            try:
+                stage()
+            except BaseException as e:
+                errors.append(e)
+                if inbox is not None:
+                    while inbox.get() is not None:
+                        pass
+            finally:
+                for _ in range(sentinels if outbox is not None else 0):
+                    outbox.put(None)
+
+        return run
+
+    def step_finished(carryname, expected=None, ok=True):
+        with progress_lock:
+            state = progress[carryname]
+            if expected is not None:
+                state["expected"] = expected
+            else:
+                state["done"] += 1
+            state["failed"] = state["failed"] or not ok
+
+            # Report each carry once, as soon as its outcome is known
+            complete = state["expected"] is not None and (
+                state["done"] == state["expected"] or state["failed"]
+            )
+            if not complete or state["reported"]:
+                return
+            state["reported"] = True
+            ok = not state["failed"]
+
+        finished_queue.put((carryname, ok))
+
+    def render_stage(executor):
+        for carryname in carrynames:
+            pdf_path = os.path.join(tutorial_dir, f"{carryname}.pdf")
+            try:
+                num_pages = len(PdfReader(pdf_path).pages)
+            except Exception as e:
+                print(f"Failed to read {pdf_path}: {e}")
+                num_pages = None
+
+            for m in range(num_pages or 0):
+                future = executor.submit(
+                    extract_page_steps,
+                    pdf_path,
+                    m,
+                    carryname,
+                    dpi,
+                    blank_tolerance,
+                    probe_dpi,
+                    mode,
+                )
+                pages_queue.put((carryname, future))
+            pages_queue.put((carryname, num_pages is not None))
+
+    def number_stage():
+        counters = {}
+        failed = set()
+        while (item := pages_queue.get()) is not None:
+            carryname, future = item
+
+            # End of a tutorial, its number of steps is now known
+            if isinstance(future, bool):
+                ok = future and carryname not in failed
+                step_finished(carryname, expected=counters.get(carryname, 0), ok=ok)
+                continue
+
+            try:
+                pngs = future.result()
+            except Exception as e:
+                print(f"Failed to extract a page of {carryname}: {e}")
+                failed.add(carryname)
+                continue
+
+            # Numbering would have a gap, so stop sending this tutorial
+            if carryname in failed:
+                continue
+
+            for png in pngs:
+                counters[carryname] = counters.get(carryname, 0) + 1
+                step_png_filename = (
+                    f"{carryname}_step{str(counters[carryname]).zfill(2)}.png"
+                )
+                uploads_queue.put((carryname, step_png_filename, png))
+
+    def upload_stage():
+        while (item := uploads_queue.get()) is not None:
+            carryname, step_png_filename, png = item
+            ok = True
+            if step_png_filename in existing_names:
+                print(f"Skipped {step_png_filename} (already exists)")
+            else:
+                try:
+                    db_utils.upload_png_data(step_png_filename, png)
+                except Exception as e:
+                    print(f"Failed to upload {step_png_filename}: {e}")
+                    ok = False
+            step_finished(carryname, ok=ok)
+
+    def publish_stage():
+        while (item := finished_queue.get()) is not None:
+            carryname, ok = item
+            if ok:
+                # Mark as tutorial available in production db
+                db_utils.update_value_in_table(carryname)
+                summary["published"].append(carryname)
+            else:
+                print(f"Not publishing {carryname}, some steps failed")
+                summary["failed"].append(carryname)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        threads = [
+            threading.Thread(
+                target=guarded(lambda: render_stage(executor), outbox=pages_queue)
+            ),
+            threading.Thread(
+                target=guarded(
+                    number_stage,
+                    inbox=pages_queue,
+                    outbox=uploads_queue,
+                    sentinels=upload_workers,
+                )
+            ),
+        ]
+        threads += [
+            threading.Thread(target=guarded(upload_stage, inbox=uploads_queue))
+            for _ in range(upload_workers)
+        ]
+        publisher = threading.Thread(
+            target=guarded(publish_stage, inbox=finished_queue)
+        )
+
+        publisher.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        finished_queue.put(None)
+        publisher.join()
+
+    # A stage failed as a whole, e.g. the process pool broke
+    if errors:
+        raise errors[0]
+
+    print(
+        f"Published {len(summary['published'])} tutorials, "
+        f"failed {len(summary['failed'])}"
+    )
+    return summary
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Generate an instagram post from a tutorial"
@@ -88,7 +543,52 @@ if __name__ == "__main__":
     parser.add_argument(
         "output_dir", type=str, help="Directory where the PDF will be saved"
     )
-    parser.add_argument("carryname", type=str, help="Name of the carry, e.g. giselles")
+    parser.add_argument(
+        "carryname",
+        type=str,
+        nargs="?",
+        help="Name of the carry, e.g. giselles. Omit with --all",
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Extract every tutorial in the directory",
+    )
+    parser.add_argument(
+        "--blank-tolerance",
+        type=int,
+        default=BLANK_TOLERANCE,
+        help="How far below white a pixel may be in a blank cell, 0 (default) for pure white",
+    )
+    parser.add_argument(
+        "--probe-dpi",
+        type=int,
+        default=PROBE_DPI,
+        help="Resolution of a blank check before the full render, 0 (default) to skip it",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["page", "cells"],
+        default="page",
+        help="Render each page once and crop it, or render every cell separately",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of pages extracted in parallel, defaults to the CPU count",
+    )
     args = parser.parse_args()
 
-    extract_steps_to_png(args.output_dir, args.carryname)
+    options = dict(
+        blank_tolerance=args.blank_tolerance,
+        probe_dpi=args.probe_dpi,
+        mode=args.mode,
+        workers=args.workers,
+    )
+    if args.all:
+        extract_all_tutorials(args.output_dir, **options)
+    elif args.carryname:
+        extract_steps_to_png(args.output_dir, args.carryname, **options)
+    else:
+        parser.error("carryname is required unless --all is given")
@@ -1,20 +1,39 @@
+import argparse
 from utils import BookGenerator
 from utils import db_utils
 from utils import data_utils
 
 
-def main():
-    # Get carries from supabase
-    carries = db_utils.get_carries()
+def main(incremental=False, workers=1):
+    # Get carries and their steps from supabase
+    carries = db_utils.load_book_data()
 
     # Create generator and cover page
     generator = BookGenerator.BookGenerator()
 
     # for carry in carries:
     generator.create_combined_pdf(
-        output_path=".", output_filename="book.pdf", carries=carries
+        output_path=".",
+        output_filename="book.pdf",
+        carries=carries,
+        incremental=incremental,
+        workers=workers,
     )
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Generate the book with all carries")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only re-render carries that changed since the last build",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes rendering carries in parallel",
+    )
+    args = parser.parse_args()
+
+    main(args.incremental, args.workers)
@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decouple import config
+from utils import db_utils
+from utils import http_utils
+from utils import LocalStorage
+
+SYNC_WORKERS = config("SYNC_WORKERS", default=8, cast=int)
+INDEX_FILENAME = "sync.json"
+
+
+def remote_state(file):
+    """
+    Describe a bucket object by the listing metadata that changes with it.
+
+    Parameters:
+    - file: dict, entry as returned by the storage API listing
+
+    Returns:
+    - dict, size, ETag and update time of the object
+    """
+    metadata = file.get("metadata") or {}
+    return {
+        "size": metadata.get("size"),
+        "etag": metadata.get("eTag"),
+        "updated_at": file.get("updated_at"),
+    }
+
+
+def is_unchanged(path, state, synced):
+    """
+    Check whether the local copy of an object is still current.
+
+    Parameters:
+    - path: str, path of the local copy
+    - state: dict, remote state as returned by remote_state
+    - synced: dict or None, remote state recorded when the copy was downloaded
+
+    Returns:
+    - bool, True if the object does not need to be downloaded again
+    """
+    if synced is None or not os.path.exists(path):
+        return False
+    if state["size"] is not None and os.path.getsize(path) != state["size"]:
+        return False
+    if state["etag"] and synced.get("etag"):
+        return state["etag"] == synced["etag"]
+    return state["updated_at"] == synced.get("updated_at")
+
+
+def load_index(local_dir):
+    try:
+        with open(os.path.join(local_dir, INDEX_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_index(local_dir, index):
+    path = os.path.join(local_dir, INDEX_FILENAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
+
+
+def download(url, path):
+    response = http_utils.get(url)
+    response.raise_for_status()
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(response.content)
+    os.replace(tmp_path, path)
+    return len(response.content)
+
+
+def sync_bucket(local_dir, workers=SYNC_WORKERS, prune=True):
+    """
+    Mirror the Supabase bucket and carries table into a local directory.
+
+    Only objects that are new, or whose size, ETag or update time changed
+    since the last sync, are downloaded, concurrently. Local files that are no
+    longer in the bucket are removed unless prune is False. The directory can
+    then be used with STORAGE_BACKEND=local.
+
+    Parameters:
+    - local_dir: str, directory to mirror into
+    - workers: int, number of concurrent downloads
+    - prune: bool, remove local files deleted from the bucket
+
+    Returns:
+    - dict, lists of file names downloaded, unchanged, pruned and failed
+    """
+    if db_utils.STORAGE_BACKEND != "supabase":
+        raise ValueError(
+            "The sync reads from Supabase, run it with STORAGE_BACKEND=supabase"
+        )
+
+    storage = LocalStorage.LocalStorage(local_dir)
+    os.makedirs(storage.steps_dir, exist_ok=True)
+
+    rows, files = asyncio.run(db_utils.get_snapshot_async())
+    storage.save_carry_rows(rows)
+    print(f"Saved {len(rows)} carries")
+
+    index = load_index(local_dir)
+    summary = {"downloaded": [], "unchanged": [], "pruned": [], "failed": []}
+
+    remote = {file["name"]: file for file in files if file.get("name")}
+    to_download = []
+    for name, file in remote.items():
+        if is_unchanged(
+            os.path.join(storage.steps_dir, name), remote_state(file), index.get(name)
+        ):
+            summary["unchanged"].append(name)
+        else:
+            to_download.append(name)
+
+    signed_urls = db_utils.get_signed_urls(to_download)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [
+            (
+                name,
+                executor.submit(
+                    download, signed_urls[name], os.path.join(storage.steps_dir, name)
+                ),
+            )
+            for name in to_download
+            if name in signed_urls
+        ]
+        summary["failed"] += [name for name in to_download if name not in signed_urls]
+
+        for name, future in futures:
+            try:
+                future.result()
+                index[name] = remote_state(remote[name])
+                summary["downloaded"].append(name)
+            except Exception as e:
+                print(f"Failed to download {name}: {e}")
+                summary["failed"].append(name)
+
+    if prune:
+        for entry in os.scandir(storage.steps_dir):
+            if entry.is_file() and entry.name not in remote:
+                os.remove(entry.path)
+                index.pop(entry.name, None)
+                summary["pruned"].append(entry.name)
+
+    save_index(local_dir, index)
+
+    print(
+        f"Downloaded {len(summary['downloaded'])}, "
+        f"unchanged {len(summary['unchanged'])}, pruned {len(summary['pruned'])}, "
+        f"failed {len(summary['failed'])}"
+    )
+    print(http_utils.report())
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Mirror the Supabase bucket and carries into a local directory"
+    )
+    parser.add_argument(
+        "local_dir",
+        type=str,
+        nargs="?",
+        default=db_utils.LOCAL_STORAGE_DIR,
+        help="Directory to mirror into, defaults to LOCAL_STORAGE_DIR",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=SYNC_WORKERS,
+        help="Number of concurrent downloads",
+    )
+    parser.add_argument(
+        "--no-prune",
+        action="store_true",
+        help="Keep local files that were deleted from the bucket",
+    )
+    args = parser.parse_args()
+
+    summary = sync_bucket(args.local_dir, args.workers, prune=not args.no_prune)
+    if summary["failed"]:
+        raise SystemExit(1)
@@ -4,13 +4,19 @@ from reportlab.lib.utils import ImageReader
 from reportlab.lib.units import inch
 from reportlab.platypus import Paragraph, Spacer, Frame
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase import pdfmetrics
-import requests
+from reportlab.graphics import renderPDF
+from decouple import config, Csv
+import functools
+import hashlib
+import threading
 import os
 import io
 from PIL import Image
+from utils import http_utils
 from utils import image_utils
+from utils import ImageCache
+from utils import ImageRegistry
+from utils import ImagePrefetcher
 from utils import qr_utils
 from utils import fonts
 from utils import colors_utils
@@ -19,7 +25,12 @@ from utils import colors_utils
 class BaseContentGenerator:
     """Class for generating PDF cover pages with background images and formatted text."""
 
-    def __init__(self, page_size=A4, margin=inch):
+    # How far apart the color bands of a pixel may be for it to count as gray
+    GRAYSCALE_TOLERANCE = 4
+
+    def __init__(
+        self, page_size=A4, margin=inch, prefetch_workers=None, cover_mode=None
+    ):
         """
         Initialize the cover page generator with basic settings.
 
@@ -27,38 +38,77 @@ class BaseContentGenerator:
             page_size (tuple): Width and height of the page
             margin (float): Margin size in points
                                each containing a dict with 'name' and 'path'
+            prefetch_workers (int, optional): Number of step images downloaded
+                concurrently. Defaults to the PREFETCH_WORKERS setting.
+            cover_mode (str, optional): "raster" to draw covers as PNG images,
+                "vector" to draw them as PDF vector graphics. Defaults to the
+                COVER_MODE setting.
+
+        Step images are resampled to the size of their grid cell at IMAGE_DPI
+        (0 keeps the original resolution) and stored as JPEG at JPEG_QUALITY,
+        in a single gray band when GRAYSCALE_IMAGES is on and they have no color.
+        Images in one of the IMAGE_PASSTHROUGH formats that are already small
+        enough are embedded as downloaded instead.
         """
         self.page_size = page_size
         self.width, self.height = page_size
         self.margin = margin
-        self.registered_fonts = set()
-        self.page = 0
+        if prefetch_workers is None:
+            prefetch_workers = config("PREFETCH_WORKERS", default=4, cast=int)
+        self.prefetch_workers = prefetch_workers
+        self.cover_mode = cover_mode or config("COVER_MODE", default="raster")
+        self.image_cache = ImageCache.ImageCache(
+            config("IMAGE_CACHE_DIR", default=".cache/steps"),
+            config("IMAGE_CACHE_MAX_MB", default=500, cast=int) * 1024 * 1024,
+        )
+        self.image_registry = ImageRegistry.ImageRegistry()
+        self.image_dpi = config("IMAGE_DPI", default=200, cast=int)
+        self.jpeg_quality = config("JPEG_QUALITY", default=85, cast=int)
+        self.grayscale_images = config("GRAYSCALE_IMAGES", default=True, cast=bool)
+        self.passthrough_formats = config(
+            "IMAGE_PASSTHROUGH", default="JPEG,PNG", cast=Csv(str.upper)
+        )
+        self.images_passed_through = 0
+        self.images_transcoded = 0
+        self._image_stats_lock = threading.Lock()
+
+        # Requests are counted process-wide, this generator reports its own
+        self._http_stats_start = http_utils.get_stats()
 
-        # Register fonts
-        for font_info in fonts.FONTCONFIG:
-            self._register_font(font_info["name"], font_info["path"])
+        self.page = 0
+        self.number_pages = True
+        self._title_styles = {}
 
-    def _register_font(self, font_name, font_path):
+    def _set_font(self, c, font_name, size):
         """
-        Register a font for use in the PDF.
+        Set the current font, registering it on first use.
 
         Args:
-            font_name (str): Name to refer to the font
-            font_path (str): Path to the font file
+            c (canvas): The ReportLab canvas to draw on
+            font_name (str): Name of the font, see fonts.FONTCONFIG
+            size (float): Font size in points
+        """
+        fonts.register_font(font_name)
+        c.setFont(font_name, size)
 
-        Returns:
-            bool: True if font was registered successfully, False otherwise
+    def _stamp_form(self, c, name, draw):
         """
-        if font_name in self.registered_fonts:
-            return True
+        Draw static content through a form XObject recorded once per document.
 
-        try:
-            pdfmetrics.registerFont(TTFont(font_name, font_path))
-            self.registered_fonts.add(font_name)
-            return True
-        except Exception as e:
-            logger.error(f"Failed to register font {font_name}: {e}")
-            return False
+        The first call for a name records whatever draw(c) paints into a form;
+        every call, including the first, then places that form on the current
+        page, so repeated page chrome is written to the PDF only once.
+
+        Args:
+            c (canvas): The ReportLab canvas to draw on
+            name (str): Name of the form, unique for its content
+            draw (callable): Draws the content in page coordinates
+        """
+        if not c.hasForm(name):
+            c.beginForm(name)
+            draw(c)
+            c.endForm()
+        c.doForm(name)
 
     def _draw_background_image(self, c, image_path, color, w, h, x, y):
         """
@@ -69,7 +119,13 @@ class BaseContentGenerator:
             image_path (str): Path to the background image
         """
         hex_color = colors_utils.rgb_to_hex(color)
-        img = image_utils.transform_svg_cover(os.path.join(image_path), hex_color)
+        if self.cover_mode == "vector":
+            self._draw_vector_cover(c, image_path, hex_color, w, h, x, y)
+            return
+
+        img = image_utils.transform_svg_cover(
+            os.path.join(image_path), hex_color, width=w, height=h
+        )
 
         img_width, img_height = img.getSize()
 
@@ -80,10 +136,47 @@ class BaseContentGenerator:
 
         c.drawImage(img, x, y, width=new_width, height=new_height, mask="auto")
 
+    def _draw_vector_cover(self, c, image_path, hex_color, w, h, x, y):
+        """
+        Draw an SVG cover as vector graphics, preserving its aspect ratio.
+
+        The recolored cover is compiled once per document into a form XObject,
+        so drawing it again only adds a reference to the page.
+
+        Args:
+            c (canvas): The ReportLab canvas to draw on
+            image_path (str): Path to the SVG cover
+            hex_color (str): Color to paint the cover in, e.g. "9e9a95"
+        """
+        drawing = image_utils.svg_cover_drawing(image_path, hex_color)
+
+        form_name = (
+            "Cover"
+            + hashlib.sha1(
+                f"{image_path}:{os.path.getmtime(image_path)}:{hex_color}".encode()
+            ).hexdigest()
+        )
+        if not c.hasForm(form_name):
+            c.beginForm(form_name, 0, 0, drawing.width, drawing.height)
+            renderPDF.draw(drawing, c, 0, 0)
+            c.endForm()
+
+        # Preserve aspect ratio
+        ratio = min(w / drawing.width, h / drawing.height)
+
+        c.saveState()
+        c.translate(x, y)
+        c.scale(ratio, ratio)
+        c.doForm(form_name)
+        c.restoreState()
+
     def _add_page(self, c):
+        if not self.number_pages:
+            return
+
         # Page number under the line
         page_number_y = self.height - self.margin
-        c.setFont("Poppins-Regular", 14)
+        self._set_font(c, "Poppins-Regular", 14)
         c.drawRightString(self.width - self.margin, page_number_y, f"{self.page}")
 
     def _add_title(self, c, carry, text_color, frame_height):
@@ -134,6 +227,26 @@ class BaseContentGenerator:
         Returns:
             tuple: The paragraphs for title, subtitle, size, and mmposition
         """
+        title_style, subtitle_style = self._get_title_styles(text_color)
+
+        title_paragraph = Paragraph(carry.title, title_style)
+        subtitle_paragraph = Paragraph(carry.finish, subtitle_style)
+
+        return title_paragraph, subtitle_paragraph
+
+    def _get_title_styles(self, text_color):
+        """
+        Get the title and subtitle paragraph styles, built once per text color
+
+        Args:
+            text_color: Color of the text
+
+        Returns:
+            tuple: The styles for title and subtitle
+        """
+        if text_color in self._title_styles:
+            return self._title_styles[text_color]
+
         styles = getSampleStyleSheet()
 
         title_style = ParagraphStyle(
@@ -156,20 +269,11 @@ class BaseContentGenerator:
             leading=22,
         )
 
-        size_style = ParagraphStyle(
-            "SizeStyle",
-            parent=styles["Normal"],
-            fontName="Poppins-Light",
-            fontSize=20,
-            textColor=text_color,
-            alignment=0,
-            leading=22,
-        )
-
-        title_paragraph = Paragraph(carry.title, title_style)
-        subtitle_paragraph = Paragraph(carry.finish, subtitle_style)
+        for style in (title_style, subtitle_style):
+            fonts.register_font(style.fontName)
 
-        return title_paragraph, subtitle_paragraph
+        self._title_styles[text_color] = (title_style, subtitle_style)
+        return title_style, subtitle_style
 
     def _add_size(self, c, carry, text_color):
         # Set text color
@@ -177,22 +281,22 @@ class BaseContentGenerator:
 
         # Add the text
         sizepos_text_y = self.height * 2.15 / 3
-        c.setFont("Poppins-Regular", 24)
+        self._set_font(c, "Poppins-Regular", 24)
         c.drawString(self.margin, sizepos_text_y, f"{carry.position} | {carry.size}")
 
-    def _calculate_pages_needed(self, urls):
+    def _calculate_pages_needed(self, steps):
         """
         Calculate how many pages needed for the tutorial images
 
         Args:
-            urls (list): List of image URLs
+            steps (list): List of tutorial steps
 
         Returns:
             int: Number of pages needed
         """
         grid_size = 9  # 3x3 grid
-        num_pages = len(urls) // grid_size
-        if len(urls) % grid_size > 0:
+        num_pages = len(steps) // grid_size
+        if len(steps) % grid_size > 0:
             num_pages += 1
         return num_pages
 
@@ -214,46 +318,197 @@ class BaseContentGenerator:
 
         return image_width, image_height, gap_x
 
-    def _download_and_place_image(self, c, url, x, y, width, height):
+    def _render_settings(self):
+        """
+        Settings that change the generated PDF without changing the code
+
+        Returns:
+            dict: Setting names and values
+        """
+        return {
+            "page_size": list(self.page_size),
+            "margin": self.margin,
+            "cover_mode": self.cover_mode,
+            "image_dpi": self.image_dpi,
+            "jpeg_quality": self.jpeg_quality,
+            "grayscale_images": self.grayscale_images,
+            "passthrough_formats": self.passthrough_formats,
+        }
+
+    def _apply_render_settings(self, settings):
         """
-        Download an image from URL and place it on the canvas
+        Take over the settings of another generator, see _render_settings
 
         Args:
-            c (canvas): The ReportLab canvas to draw on
-            url (str): URL of the image to download
-            x (float): X-position on the canvas
-            y (float): Y-position on the canvas
-            width (float): Width to render the image
-            height (float): Height to render the image
+            settings (dict): Setting names and values
+        """
+        settings = dict(settings)
+        self.page_size = tuple(settings.pop("page_size"))
+        self.width, self.height = self.page_size
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+    def _can_pass_through(self, img, size):
+        """
+        Check whether an image can be embedded without decoding and re-encoding it
+
+        Args:
+            img (Image): Opened, not yet decoded, image
+            size (tuple, optional): (width, height) in points it will be drawn at
+
+        Returns:
+            bool: True if its format, color space and resolution are acceptable
         """
-        # Download image
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
+        if img.format not in self.passthrough_formats:
+            return False
+        if img.mode not in ("L", "RGB"):
+            return False
+        if size is not None and self.image_dpi > 0:
+            return image_utils.fits_box(img, size[0], size[1], self.image_dpi)
+        return True
+
+    def _prepare_image_data(self, data, size=None):
+        """
+        Convert downloaded image bytes into a form ReportLab embeds compactly
 
-        # Process image data
-        img_data = io.BytesIO(response.content)
-        img = Image.open(img_data).convert("RGB")
+        Args:
+            data (bytes): Encoded image data
+            size (tuple, optional): (width, height) in points of the box the
+                image will be drawn in. The image is downsampled to fit it at
+                image_dpi; if not given the original resolution is kept.
+
+        Returns:
+            bytes: Encoded image data, the original bytes if they can be
+                embedded as they are and JPEG otherwise
+        """
+        # Only the header is read here, pixel data is decoded on first use
+        img = Image.open(io.BytesIO(data))
+        if self._can_pass_through(img, size):
+            with self._image_stats_lock:
+                self.images_passed_through += 1
+            return data
+
+        with self._image_stats_lock:
+            self.images_transcoded += 1
+        if img.mode not in ("L", "RGB"):
+            img = img.convert("RGB")
+        if size is not None and self.image_dpi > 0:
+            img = image_utils.fit_to_box(img, size[0], size[1], self.image_dpi)
+
+        mode = "RGB"
+        if self.grayscale_images and image_utils.is_grayscale(
+            img, self.GRAYSCALE_TOLERANCE
+        ):
+            mode = "L"
+        img = img.convert(mode)
 
         # Save to buffer for ReportLab
         img_buffer = io.BytesIO()
-        img.save(img_buffer, format="JPEG")
-        img_buffer.seek(0)
+        img.save(img_buffer, format="JPEG", quality=self.jpeg_quality)
+
+        return img_buffer.getvalue()
+
+    def _load_step_image(self, step, size=None):
+        """
+        Load a tutorial step image through the on-disk image cache
+
+        Args:
+            step (dict): Step with 'name', 'url' and 'version' keys
+            size (tuple, optional): (width, height) in points it will be drawn at
+
+        Returns:
+            bytes: Encoded image data
+        """
+        data = self.image_cache.get(step["name"], step["url"], step.get("version"))
+        return self._prepare_image_data(data, size)
+
+    def _prefetch_images(self, steps, size=None):
+        """
+        Start loading step images in the background, in the order given
+
+        Args:
+            steps (list): List of steps as returned by get_tutorial_steps_by_carry
+            size (tuple, optional): (width, height) in points of a grid cell
+
+        Returns:
+            ImagePrefetcher: Indexable by position in steps, blocks until ready
+        """
+        return ImagePrefetcher.ImagePrefetcher(
+            functools.partial(self._load_step_image, size=size),
+            steps,
+            max_workers=self.prefetch_workers,
+        )
+
+    def _build_stats(self):
+        """
+        Counters collected while building, in a form that can cross processes
+
+        Returns:
+            dict: Image cache and image registry counters
+        """
+        return {
+            "cache_hits": self.image_cache.hits,
+            "cache_misses": self.image_cache.misses,
+            "cache_revalidated": self.image_cache.revalidated,
+            "images_unique": self.image_registry.unique,
+            "images_reused": self.image_registry.reused,
+            "image_bytes_saved": self.image_registry.bytes_saved,
+            "images_passed_through": self.images_passed_through,
+            "images_transcoded": self.images_transcoded,
+            "http": http_utils.stats_since(self._http_stats_start),
+        }
+
+    def _add_build_stats(self, stats):
+        """
+        Add counters collected by another generator, e.g. in a worker process
 
-        # Draw image on canvas
-        img_reader = ImageReader(img_buffer)
-        c.drawImage(
-            img_reader, x, y, width=width, height=height, preserveAspectRatio=True
+        Args:
+            stats (dict): Counters as returned by _build_stats
+        """
+        self.image_cache.hits += stats["cache_hits"]
+        self.image_cache.misses += stats["cache_misses"]
+        self.image_cache.revalidated += stats["cache_revalidated"]
+        self.image_registry.unique += stats["images_unique"]
+        self.image_registry.reused += stats["images_reused"]
+        self.image_registry.bytes_saved += stats["image_bytes_saved"]
+        self.images_passed_through += stats["images_passed_through"]
+        self.images_transcoded += stats["images_transcoded"]
+        http_utils.add_stats(stats["http"])
+
+    def _report_build_stats(self):
+        """Persist the image cache index and print the image counters."""
+        self.image_cache.save()
+        print(self.image_cache.report())
+        print(self.image_registry.report())
+        print(
+            f"Step images: {self.images_passed_through} passed through, "
+            f"{self.images_transcoded} transcoded"
         )
+        print(http_utils.report(http_utils.stats_since(self._http_stats_start)))
+
+    def _place_image(self, c, data, x, y, width, height):
+        """
+        Place an already downloaded image on the canvas
+
+        Args:
+            c (canvas): The ReportLab canvas to draw on
+            data (bytes): Encoded image data
+            x (float): X-position on the canvas
+            y (float): Y-position on the canvas
+            width (float): Width to render the image
+            height (float): Height to render the image
+        """
+        self.image_registry.draw(c, data, x, y, width, height, preserveAspectRatio=True)
 
     def _create_tutorial_grid_page(
-        self, c, urls, page_index, carry, image_width, image_height, gap_x
+        self, c, images, page_index, carry, image_width, image_height, gap_x
     ):
         """
         Create a single tutorial page with images arranged in a 3x3 grid
 
         Args:
             c (canvas): The ReportLab canvas to draw on
-            urls (list): List of all image URLs
+            images: Downloaded images for all steps, indexable by step
             page_index (int): Current page index (zero-based)
             carry: Object containing carry information
             image_width (float): Width for each image
@@ -267,7 +522,7 @@ class BaseContentGenerator:
         # Calculate which images to show on this page
         grid_size = 9  # 3x3 grid
         start_idx = page_index * grid_size
-        end_idx = min(start_idx + grid_size, len(urls))
+        end_idx = min(start_idx + grid_size, len(images))
 
         # Place each image in the grid
         for j in range(start_idx, end_idx):
@@ -282,4 +537,4 @@ class BaseContentGenerator:
             y = self.margin + (row * image_height)
 
             # Place the image
-            self._download_and_place_image(c, urls[j], x, y, image_width, image_height)
+            self._place_image(c, images[j], x, y, image_width, image_height)
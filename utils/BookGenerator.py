@@ -1,13 +1,44 @@
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
-from reportlab.lib.utils import ImageReader
+from concurrent.futures import ProcessPoolExecutor
+from decouple import config
+import hashlib
+import io
+import json
 import os
+import sys
+import tempfile
 from utils import colors_utils
 from utils import db_utils
+from utils import fonts
+from utils import image_utils
 from utils import qr_utils
 from utils import BaseContentGenerator
 from utils import HorizontalLine
-import shutil
+from utils import ImageCache
+from utils import ImageRegistry
+
+
+def _layout_version():
+    """Hash the source of every module that affects how a carry is drawn."""
+    digest = hashlib.sha256()
+    for module in (
+        BaseContentGenerator,
+        HorizontalLine,
+        ImageCache,
+        ImageRegistry,
+        colors_utils,
+        fonts,
+        image_utils,
+        qr_utils,
+        sys.modules[__name__],
+    ):
+        with open(module.__file__, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+LAYOUT_VERSION = _layout_version()
 
 
 class BookGenerator(BaseContentGenerator.BaseContentGenerator):
@@ -21,10 +52,11 @@ class BookGenerator(BaseContentGenerator.BaseContentGenerator):
             line_y: Y-position for the horizontal line
         """
         # Draw horizontal line at the top
-        line = HorizontalLine.HorizontalLine(
-            width=self.width - self.margin, thickness=1
+        self._stamp_form(
+            c,
+            f"BookHeaderLine{round(line_y)}",
+            lambda c: self._draw_header_line(c, line_y),
         )
-        line.drawOn(c, self.margin / 2, line_y)
 
         # Header text position - slightly above the line
         header_y = line_y + 5
@@ -32,12 +64,18 @@ class BookGenerator(BaseContentGenerator.BaseContentGenerator):
         header_font_size = 10
 
         # Set font and draw header text
-        c.setFont(header_font, header_font_size)
+        self._set_font(c, header_font, header_font_size)
         c.drawString(self.margin / 2, header_y, carry.title)  # Left-aligned title
         c.drawRightString(
             self.width - self.margin / 2, header_y, carry.finish
         )  # Right-aligned finish
 
+    def _draw_header_line(self, c, line_y):
+        line = HorizontalLine.HorizontalLine(
+            width=self.width - self.margin, thickness=1
+        )
+        line.drawOn(c, self.margin / 2, line_y)
+
     def _draw_page_footer(self, c):
         """
         Draw the page footer with page number and horizontal line
@@ -45,19 +83,33 @@ class BookGenerator(BaseContentGenerator.BaseContentGenerator):
         Args:
             c (canvas): The ReportLab canvas to draw on
         """
+        self._stamp_form(c, "BookFooter", self._draw_footer_line)
+        self._draw_footer_page_number(c)
+
+    def _draw_footer_line(self, c):
         # Calculate positions
         line_y = 0.75 * self.margin
-        page_number_y = line_y - 12  # 12 points below the line
 
         # Draw short horizontal line
         line = HorizontalLine.HorizontalLine(width=2 * self.margin, thickness=1)
         line.drawOn(c, self.width / 2 - self.margin, line_y)
 
-        # Draw page number
-        c.setFont("AndaleMono", 12)
+    def _draw_footer_page_number(self, c):
+        if not self.number_pages:
+            return
+
+        page_number_y = 0.75 * self.margin - 12  # 12 points below the line
+        self._set_font(c, "AndaleMono", 12)
         c.drawCentredString(self.width / 2, page_number_y, f"{self.page:02}")
 
     def _create_background_rectangle(self, c, color):
+        self._stamp_form(
+            c,
+            "BookBackground" + hashlib.sha1(repr(color).encode("utf-8")).hexdigest(),
+            lambda c: self._draw_background_rectangle(c, color),
+        )
+
+    def _draw_background_rectangle(self, c, color):
         # Calculate the positions for the rectangle (1/3 to 2/3 of height)
         y_bottom = self.height / 5 + 20  # 1/3 from bottom
         y_top = 4 * self.height / 5 + 20  # 2/3 from bottom
@@ -73,14 +125,12 @@ class BookGenerator(BaseContentGenerator.BaseContentGenerator):
         c.restoreState()
 
     def _add_carry_qr(self, c, carry_name):
-        # Load the image
-        path = qr_utils.generate_qr(carry_name)
-        img = ImageReader(path)
-        img_width, img_height = img.getSize()
+        matrix = qr_utils.get_qr_matrix(carry_name)
 
         # Define image dimensions for the square image
         # For this example, we'll make the image take up 20% of the page width
         image_size = self.width * 0.2
+        module_size = image_size / len(matrix)
 
         # Calculate position for bottom right corner
         x_position = (
@@ -88,45 +138,67 @@ class BookGenerator(BaseContentGenerator.BaseContentGenerator):
         )  # 10 points padding from right edge
         y_position = 0.75 * self.margin  # 10 points padding from bottom edge
 
-        # Draw the image
-        c.drawImage(
-            path,
-            x_position,
-            y_position,
-            width=image_size,
-            height=image_size,
-            preserveAspectRatio=True,
-        )
+        c.saveState()
+
+        # White background, including the quiet zone around the code
+        c.setFillColor("white")
+        c.rect(x_position, y_position, image_size, image_size, fill=1, stroke=0)
+
+        # Draw each horizontal run of dark modules as a single rectangle
+        path = c.beginPath()
+        for row_index, row in enumerate(matrix):
+            y = y_position + image_size - (row_index + 1) * module_size
+            col = 0
+            while col < len(row):
+                if not row[col]:
+                    col += 1
+                    continue
+                run_start = col
+                while col < len(row) and row[col]:
+                    col += 1
+                path.rect(
+                    x_position + run_start * module_size,
+                    y,
+                    (col - run_start) * module_size,
+                    module_size,
+                )
+
+        c.setFillColor(colors_utils.LIGHTBLACK)
+        c.drawPath(path, fill=1, stroke=0)
+        c.restoreState()
 
-    def _create_tutorial_pages_for_carry(self, c, carry):
+    def _create_tutorial_pages_for_carry(self, c, carry, steps=None):
         """
         Generate pages for the picture tutorial of the carry
 
         Args:
             c (canvas): The ReportLab canvas to draw on
             carry: Object containing carry information
+            steps (list, optional): Tutorial steps, fetched from the bucket if
+                not given
 
         Returns:
             bool: True if pages were created successfully, False otherwise
         """
         # Get images from bucket
-        results = db_utils.get_tutorial_steps_by_carry(carry.name)["data"]
-        urls = [carry["url"] for carry in results]
+        if steps is None:
+            steps = db_utils.get_tutorial_steps_by_carry(carry.name)["data"]
 
         # Calculate page layout
-        num_pages = self._calculate_pages_needed(urls)
+        num_pages = self._calculate_pages_needed(steps)
         image_width, image_height, gap_x = self._calculate_grid_layout()
 
-        # Create pages with grid layout
-        for page_index in range(num_pages):
-            self.page += 1
-            c.showPage()
-            self._create_tutorial_grid_page(
-                c, urls, page_index, carry, image_width, image_height, gap_x
-            )
-            # Draw header and footer
-            self._draw_page_header(c, carry, self.height - self.margin)
-            self._draw_page_footer(c)
+        # Create pages with grid layout, downloading ahead of drawing
+        with self._prefetch_images(steps, (image_width, image_height)) as images:
+            for page_index in range(num_pages):
+                self.page += 1
+                c.showPage()
+                self._create_tutorial_grid_page(
+                    c, images, page_index, carry, image_width, image_height, gap_x
+                )
+                # Draw header and footer
+                self._draw_page_header(c, carry, self.height - self.margin)
+                self._draw_page_footer(c)
 
         # Add blank page if needed to maintain even number of pages
         if num_pages % 2 == 0:
@@ -190,30 +262,286 @@ class BookGenerator(BaseContentGenerator.BaseContentGenerator):
         line.drawOn(c, self.margin, line_y)
 
         difficulty_text_y = line_y + 12
-        c.setFont("Poppins-Light", 14)
+        self._set_font(c, "Poppins-Light", 14)
         c.drawString(self.margin, difficulty_text_y, f"{carry.difficulty}")
 
         # Page number under the line
         mmposition_text_y = line_y + 36
-        c.setFont("Poppins-Light", 14)
+        self._set_font(c, "Poppins-Light", 14)
         c.drawString(self.margin, mmposition_text_y, f"{carry.mmposition}")
 
-    def create_combined_pdf(self, output_path, output_filename, carries):
+    def _carry_fingerprint(self, carry, steps):
         """
-        Generate a combined PDF with cover pages for all carries.
+        Fingerprint everything that goes into the section of a carry.
 
         Args:
-            output_path (str): Directory where the PDF will be saved
-            output_filename (str): Name of the output PDF file
+            carry: Object containing carry information
+            steps (list): Tutorial steps of the carry
+
+        Returns:
+            str: Hex digest that changes whenever the section would change
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps(vars(carry), sort_keys=True).encode("utf-8"))
+        digest.update(
+            json.dumps([(step["name"], step.get("version")) for step in steps]).encode(
+                "utf-8"
+            )
+        )
+        with open(os.path.join("covers", f"{carry.name}.svg"), "rb") as f:
+            digest.update(f.read())
+        digest.update(
+            json.dumps(self._render_settings(), sort_keys=True).encode("utf-8")
+        )
+        digest.update(LAYOUT_VERSION.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _refresh_step_urls(self, steps):
+        """
+        Get current URLs for steps that were listed when the build was planned.
+
+        Signed URLs may have expired by the time a fragment is rendered in a
+        long build, so they are looked up again through db_utils, which re-signs
+        URLs close to expiry. Only the steps of this carry are signed, without
+        listing the bucket, as worker processes may start with empty caches.
+        The steps themselves, and so the page plan, stay as planned.
+
+        Args:
+            steps (list): Tutorial steps of a carry, as planned
+
+        Returns:
+            list: The same steps, with fresh URLs where available
+        """
+        urls = db_utils.get_signed_urls([step["name"] for step in steps])
+        return [
+            dict(step, url=urls[step["name"]]) if step["name"] in urls else step
+            for step in steps
+        ]
+
+    def _render_carry_fragment(self, carry, steps, path, start_page=None):
+        """
+        Render the section of a carry into its own PDF.
+
+        Args:
+            carry: Object containing carry information
+            steps (list): Tutorial steps of the carry, their URLs are refreshed
+                before drawing
+            path (str): Where to write the fragment
+            start_page (int, optional): Number of the cover page. If not given,
+                pages are left unnumbered so the fragment can go anywhere
+        """
+        steps = self._refresh_step_urls(steps)
+
+        c = canvas.Canvas(path, pagesize=self.page_size)
+        self.number_pages = start_page is not None
+        self.page = start_page or 0
+        try:
+            self._create_cover_page_for_carry(c, carry)
+            self._create_tutorial_pages_for_carry(c, carry, steps)
+        finally:
+            self.number_pages = True
+        c.save()
+
+    def _render_fragments(self, jobs, workers):
+        """
+        Render carry fragments, in worker processes if workers > 1.
+
+        Args:
+            jobs (list): (carry, steps, path, start_page) for each fragment
+            workers (int): Number of worker processes
+        """
+        if workers <= 1 or len(jobs) <= 1:
+            for carry, steps, path, start_page in jobs:
+                print(f"-Generate {carry.name}")
+                self._render_carry_fragment(carry, steps, path, start_page)
+            return
+
+        # Workers draw with this generator's settings, which the fragment
+        # fingerprints are computed from
+        settings = self._render_settings()
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            futures = [
+                (
+                    job[0],
+                    executor.submit(
+                        _render_fragment_in_worker,
+                        settings,
+                        self.prefetch_workers,
+                        *job,
+                    ),
+                )
+                for job in jobs
+            ]
+            for carry, future in futures:
+                stats = future.result()
+                print(f"-Generate {carry.name}")
+                self._add_build_stats(stats)
+
+    def _count_carry_pages(self, steps):
+        """
+        Count the pages in the section of a carry: the cover, the tutorial
+        pages, and a blank page when the tutorial has an even number of pages
+        (see _create_tutorial_pages_for_carry).
+
+        Args:
+            steps (list): Tutorial steps of the carry
+
+        Returns:
+            int: Number of pages
+        """
+        num_pages = self._calculate_pages_needed(steps)
+        return 1 + num_pages + (1 if num_pages % 2 == 0 else 0)
+
+    def _plan_page_offsets(self, steps_by_carry):
+        """
+        Work out the number of the first page of each carry section.
+
+        Args:
+            steps_by_carry (list): Tutorial steps of each carry, in book order
+
+        Returns:
+            list: Number of the cover page of each carry
+        """
+        offsets = []
+        next_page = 1
+        for steps in steps_by_carry:
+            offsets.append(next_page)
+            next_page += self._count_carry_pages(steps)
+        return offsets
+
+    def _create_parallel_pdf(self, output_full_path, carries, workers):
+        """
+        Render carry sections in worker processes and merge them in order.
+
+        Page numbers are planned up front from the step counts, so each worker
+        numbers its own pages.
+
+        Args:
+            output_full_path (str): Path of the output PDF
             carries (list): List of carry objects
+            workers (int): Number of worker processes
+        """
+        steps_by_carry = [
+            db_utils.get_tutorial_steps_by_carry(carry.name)["data"]
+            for carry in carries
+        ]
+        offsets = self._plan_page_offsets(steps_by_carry)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs = [
+                (carry, steps, os.path.join(tmp_dir, f"{i:04}.pdf"), start_page)
+                for i, (carry, steps, start_page) in enumerate(
+                    zip(carries, steps_by_carry, offsets)
+                )
+            ]
+            self._render_fragments(jobs, workers)
+            self._stitch_fragments([path for _, _, path, _ in jobs], output_full_path)
+
+    def _render_page_numbers(self, first_page, num_pages):
+        """
+        Render the page numbers of a fragment on otherwise empty pages.
+
+        The first page of a fragment is a cover, the rest are tutorial pages.
+
+        Args:
+            first_page (int): Number of the first page of the fragment
+            num_pages (int): Number of pages in the fragment
 
         Returns:
-            bool: True if PDF was created successfully, False otherwise
+            PdfReader: One page per fragment page, to merge on top of it
         """
-        # Create full output path
-        os.makedirs(output_path, exist_ok=True)
-        output_full_path = os.path.join(output_path, output_filename)
+        from pypdf import PdfReader
+
+        buffer = io.BytesIO()
+        c = canvas.Canvas(buffer, pagesize=self.page_size)
+        for k in range(num_pages):
+            self.page = first_page + k
+            if k == 0:
+                c.setFillColor(colors_utils.LIGHTBLACK)
+                self._add_page(c)
+            else:
+                self._draw_footer_page_number(c)
+            c.showPage()
+        c.save()
+        buffer.seek(0)
+        return PdfReader(buffer)
+
+    def _stitch_fragments(self, paths, output_path, number_pages=False):
+        """
+        Merge carry fragments, in order, into one PDF.
+
+        Args:
+            paths (list): Paths of the fragments, in book order
+            output_path (str): Path of the output PDF
+            number_pages (bool): Number the pages as they are merged, for
+                fragments rendered without page numbers
+        """
+        from pypdf import PdfReader, PdfWriter
+
+        writer = PdfWriter()
+        first_page = 1
+        for path in paths:
+            reader = PdfReader(path)
+            if number_pages:
+                numbers = self._render_page_numbers(first_page, len(reader.pages))
+                for page, number in zip(reader.pages, numbers.pages):
+                    page.merge_page(number)
+            for page in reader.pages:
+                writer.add_page(page)
+            first_page += len(reader.pages)
+
+        # Fragments embed their own copies of fonts and shared images
+        writer.compress_identical_objects()
+
+        with open(output_path, "wb") as f:
+            writer.write(f)
+
+    def _create_incremental_pdf(self, output_full_path, carries, workers=1):
+        """
+        Build the book from cached per-carry fragments, rendering only the
+        carries whose fingerprint changed since the last build.
+
+        Args:
+            output_full_path (str): Path of the output PDF
+            carries (list): List of carry objects
+            workers (int): Number of processes rendering changed carries
+        """
+        cache_dir = config("BOOK_CACHE_DIR", default=".cache/book")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        fragments = []
+        jobs = []
+        for carry in carries:
+            steps = db_utils.get_tutorial_steps_by_carry(carry.name)["data"]
+            fingerprint = self._carry_fingerprint(carry, steps)
+            path = os.path.join(cache_dir, f"{carry.name}-{fingerprint[:16]}.pdf")
+
+            if os.path.exists(path):
+                print(f"-Reuse {carry.name}")
+            else:
+                # Drop fragments from previous versions of this carry
+                for filename in os.listdir(cache_dir):
+                    if filename.rsplit("-", 1)[0] == carry.name:
+                        os.remove(os.path.join(cache_dir, filename))
 
+                jobs.append((carry, steps, path + ".tmp", None))
+
+            fragments.append(path)
+
+        self._render_fragments(jobs, workers)
+        for _, _, tmp_path, _ in jobs:
+            os.replace(tmp_path, tmp_path[: -len(".tmp")])
+
+        self._stitch_fragments(fragments, output_full_path, number_pages=True)
+
+    def _create_single_pass_pdf(self, output_full_path, carries):
+        """
+        Draw every carry, one after the other, on a single canvas.
+
+        Args:
+            output_full_path (str): Path of the output PDF
+            carries (list): List of carry objects
+        """
         # Create canvas for the combined PDF
         c = canvas.Canvas(output_full_path, pagesize=self.page_size)
 
@@ -229,10 +557,57 @@ class BookGenerator(BaseContentGenerator.BaseContentGenerator):
             if i < len(carries) - 1:
                 c.showPage()
 
-        if os.path.exists("qrcodes"):
-            # Remove the folder and all of its contents
-            shutil.rmtree("qrcodes")
-
         # Save the PDF
         c.save()
+
+    def create_combined_pdf(
+        self, output_path, output_filename, carries, incremental=False, workers=1
+    ):
+        """
+        Generate a combined PDF with cover pages for all carries.
+
+        Args:
+            output_path (str): Directory where the PDF will be saved
+            output_filename (str): Name of the output PDF file
+            carries (list): List of carry objects
+            incremental (bool): Reuse cached sections of unchanged carries
+            workers (int): Number of processes rendering carries in parallel
+
+        Returns:
+            bool: True if PDF was created successfully, False otherwise
+        """
+        # Create full output path
+        os.makedirs(output_path, exist_ok=True)
+        output_full_path = os.path.join(output_path, output_filename)
+
+        if incremental:
+            self._create_incremental_pdf(output_full_path, carries, workers)
+        elif workers > 1:
+            self._create_parallel_pdf(output_full_path, carries, workers)
+        else:
+            self._create_single_pass_pdf(output_full_path, carries)
+
         print(f"Combined PDF successfully created: {output_full_path}")
+        self._report_build_stats()
+
+
+def _render_fragment_in_worker(
+    settings, prefetch_workers, carry, steps, path, start_page
+):
+    """
+    Render one carry fragment in a worker process.
+
+    Args:
+        settings (dict): Render settings of the parent generator, see
+            _render_settings
+        prefetch_workers (int): Prefetch workers of the parent generator
+
+    Returns:
+        dict: Build counters of this worker, see _build_stats
+    """
+    generator = BookGenerator(prefetch_workers=prefetch_workers)
+    generator._apply_render_settings(settings)
+    generator._render_carry_fragment(carry, steps, path, start_page)
+    generator.image_cache.save()
+
+    return generator._build_stats()
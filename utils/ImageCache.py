@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from utils import http_utils
+
+
+class ImageCache:
+    """On-disk cache for downloaded bucket objects with size-bounded LRU eviction."""
+
+    INDEX_FILENAME = "index.json"
+
+    def __init__(self, cache_dir, max_bytes):
+        """
+        Initialize the cache and load its index from disk.
+
+        Args:
+            cache_dir (str): Directory where cached files and the index live
+            max_bytes (int): Total size the cache may grow to before the least
+                recently used entries are evicted
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self._index = self._load_index()
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, self.INDEX_FILENAME)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+        # Drop entries whose file was removed behind our back
+        return {
+            name: entry
+            for name, entry in index.items()
+            if os.path.exists(os.path.join(self.cache_dir, entry["file"]))
+        }
+
+    def _file_for(self, name):
+        digest = hashlib.sha1(name.encode("utf-8")).hexdigest()
+        return digest + os.path.splitext(name)[1]
+
+    def get(self, name, url, version=None):
+        """
+        Return the content of a bucket object, downloading it only if needed.
+
+        An entry whose version matches the one from the bucket listing is
+        served from disk without touching the network. Otherwise the cached
+        copy is revalidated with a conditional GET before downloading again.
+        file:// URLs are read directly and never cached.
+
+        Args:
+            name (str): Object name in the bucket
+            url (str): URL to download the object from
+            version (str, optional): ETag or updated_at from the bucket listing
+
+        Returns:
+            bytes: Content of the object
+        """
+        if url.startswith("file://"):
+            # Already on local disk, a copy in the cache would not be faster
+            response = http_utils.get(url)
+            response.raise_for_status()
+            return response.content
+
+        with self._lock:
+            entry = self._index.get(name)
+
+        if entry is not None and version and entry.get("version") == version:
+            data = self._read(entry)
+            if data is not None:
+                self._touch(name, entry, hit=True)
+                return data
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = http_utils.get(url, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            data = self._read(entry)
+            if data is not None:
+                entry["version"] = version or entry.get("version")
+                self._touch(name, entry, hit=True, revalidated=True)
+                return data
+            response = http_utils.get(url)
+
+        response.raise_for_status()
+        data = response.content
+        self._store(name, version, response.headers, data)
+        return data
+
+    def _read(self, entry):
+        try:
+            with open(os.path.join(self.cache_dir, entry["file"]), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _touch(self, name, entry, hit, revalidated=False):
+        with self._lock:
+            entry["atime"] = time.time()
+            self._index[name] = entry
+            if hit:
+                self.hits += 1
+            if revalidated:
+                self.revalidated += 1
+
+    def _store(self, name, version, headers, data):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        filename = self._file_for(name)
+        tmp_path = os.path.join(
+            self.cache_dir, f"{filename}.{os.getpid()}.{threading.get_ident()}"
+        )
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(self.cache_dir, filename))
+
+        with self._lock:
+            self.misses += 1
+            self._index[name] = {
+                "file": filename,
+                "version": version,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "size": len(data),
+                "stored": time.time(),
+                "atime": time.time(),
+            }
+            self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        total = sum(entry["size"] for entry in self._index.values())
+        by_age = sorted(self._index.items(), key=lambda item: item[1]["atime"])
+        for name, entry in by_age:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, entry["file"]))
+            except FileNotFoundError:
+                pass
+            total -= entry["size"]
+            del self._index[name]
+
+    def _merge_entry(self, saved, entry):
+        """
+        Merge an entry of this process with the one saved by another process.
+
+        The file on disk is the one stored last, so its description (version,
+        ETag, size) comes from the entry stored last. The entry is as recent
+        as the latest use in either process, so eviction does not remove
+        files another process just used.
+        """
+        if saved is None:
+            return entry
+        merged = dict(max(saved, entry, key=lambda e: e.get("stored", 0)))
+        merged["atime"] = max(saved["atime"], entry["atime"])
+        return merged
+
+    def save(self):
+        """
+        Write the index to disk so the next build can reuse the cache.
+
+        Entries saved by other processes sharing the directory since this
+        cache was loaded are merged in, see _merge_entry.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self._index_path()}.{os.getpid()}.tmp"
+        with self._lock:
+            index = self._load_index()
+            for name, entry in self._index.items():
+                index[name] = self._merge_entry(index.get(name), entry)
+            self._index = {
+                name: entry
+                for name, entry in index.items()
+                if os.path.exists(os.path.join(self.cache_dir, entry["file"]))
+            }
+            self._evict()
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path())
+
+    def report(self):
+        return (
+            f"Image cache: {self.hits} hits ({self.revalidated} revalidated), "
+            f"{self.misses} misses"
+        )
@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ImagePrefetcher:
+    """Fetch a sequence of items ahead of use on a bounded thread pool."""
+
+    def __init__(self, fetch, items, max_workers=4, lookahead=None):
+        """
+        Initialize the prefetcher and schedule the first batch of downloads.
+
+        Args:
+            fetch (callable): Function called as fetch(item) in a worker thread
+            items (list): Items to fetch, e.g. image URLs
+            max_workers (int): Number of concurrent downloads
+            lookahead (int, optional): How many items may be in flight or
+                waiting to be drawn. Defaults to twice max_workers.
+        """
+        self.fetch = fetch
+        self.items = list(items)
+        self.max_workers = max(1, max_workers)
+        self.lookahead = lookahead or 2 * self.max_workers
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._futures = {}
+        self._next = 0
+        self._schedule(self.lookahead)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        """
+        Return the fetched result for an item, blocking until it is ready.
+
+        Results are handed out by index, so the caller decides the order in
+        which images are drawn regardless of the order downloads finish in.
+        """
+        if index < 0 or index >= len(self.items):
+            raise IndexError(index)
+
+        self._schedule(index + self.lookahead + 1)
+        future = self._futures.pop(index, None)
+        if future is None:
+            # Already consumed or outside the window, fetch it directly
+            return self.fetch(self.items[index])
+        return future.result()
+
+    def _schedule(self, until):
+        until = min(until, len(self.items))
+        while self._next < until:
+            self._futures[self._next] = self._executor.submit(
+                self.fetch, self.items[self._next]
+            )
+            self._next += 1
+
+    def close(self):
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
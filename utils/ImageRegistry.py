@@ -0,0 +1,69 @@
+import hashlib
+import io
+import threading
+from reportlab.lib.boxstuff import aspectRatioFix
+from reportlab.lib.utils import ImageReader
+
+
+class ImageRegistry:
+    """Embed each distinct image once per PDF and reuse it wherever it repeats."""
+
+    def __init__(self):
+        """Initialize an empty registry with zeroed counters."""
+        self.unique = 0
+        self.reused = 0
+        self.bytes_saved = 0
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def _form_name(self, data):
+        return "Img" + hashlib.sha1(data).hexdigest()
+
+    def draw(self, c, data, x, y, width, height, preserveAspectRatio=False, mask=None):
+        """
+        Draw encoded image bytes, embedding them only the first time they are seen.
+
+        The image is stored as a form XObject named after the hash of its bytes,
+        so identical content drawn again on any page of the same canvas points
+        at the existing object instead of adding another copy.
+
+        Args:
+            c (canvas): The ReportLab canvas to draw on
+            data (bytes): Encoded image data (JPEG or PNG)
+            x (float): X-position on the canvas
+            y (float): Y-position on the canvas
+            width (float): Width of the box to draw the image in
+            height (float): Height of the box to draw the image in
+            preserveAspectRatio (bool): Fit the image inside the box, centered
+            mask: Transparency mask, passed through to drawImage
+        """
+        name = self._form_name(data)
+        if not c.hasForm(name):
+            reader = ImageReader(io.BytesIO(data))
+            c.beginForm(name, 0, 0, 1, 1)
+            c.drawImage(reader, 0, 0, 1, 1, mask=mask)
+            c.endForm()
+            with self._lock:
+                self._sizes[name] = reader.getSize()
+                self.unique += 1
+        else:
+            with self._lock:
+                self.reused += 1
+                self.bytes_saved += len(data)
+
+        image_width, image_height = self._sizes[name]
+        x, y, width, height, _ = aspectRatioFix(
+            preserveAspectRatio, "c", x, y, width, height, image_width, image_height
+        )
+
+        c.saveState()
+        c.translate(x, y)
+        c.scale(width, height)
+        c.doForm(name)
+        c.restoreState()
+
+    def report(self):
+        return (
+            f"Image registry: {self.unique} unique images, {self.reused} reused, "
+            f"{self.bytes_saved / 1024:.1f} KiB saved"
+        )
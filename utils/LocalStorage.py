@@ -0,0 +1,207 @@
+import json
+import os
+import threading
+import pathlib
+from utils import data_utils
+from utils import db_utils
+
+
+class LocalStorage:
+    """
+    Carries and step images read from a local directory instead of Supabase.
+
+    Implements every function of db_utils.STORAGE_INTERFACE, coroutines as
+    their synchronous counterparts.
+    """
+
+    CARRIES_FILENAME = "carries.json"
+    STEPS_DIRNAME = "steps"
+
+    def __init__(self, root):
+        """
+        Initialize the storage over a directory.
+
+        The directory holds carries.json, a list of carry rows with the
+        columns of the carries table plus the difficulty rating, and a steps/
+        directory with the files of the bucket.
+
+        Args:
+            root (str): Directory holding the snapshot
+        """
+        self.root = root
+        self.steps_dir = os.path.join(root, self.STEPS_DIRNAME)
+        self._manifest = None
+        self._lock = threading.Lock()
+
+    def _carries_path(self):
+        return os.path.join(self.root, self.CARRIES_FILENAME)
+
+    def _load_rows(self):
+        try:
+            with open(self._carries_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def save_carry_rows(self, rows):
+        """
+        Replace carries.json, e.g. with rows from db_utils.get_carry_rows_async.
+
+        Args:
+            rows (list): Carry rows
+        """
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self._carries_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+        os.replace(tmp_path, self._carries_path())
+
+    def _carry_from_row(self, row):
+        return data_utils.Carry(
+            row["name"],
+            row["longtitle"],
+            row["mmposition"],
+            row["position"],
+            row["size"],
+            row["difficulty"],
+        )
+
+    def get_carry_rows(self):
+        return [row for row in self._load_rows() if row.get("tutorial")]
+
+    def get_snapshot(self):
+        return self.get_carry_rows(), self.list_bucket()
+
+    def get_carries(self):
+        return [
+            self._carry_from_row(row)
+            for row in self._load_rows()
+            if row.get("tutorial")
+        ]
+
+    def get_carry_by_name(self, carryname):
+        for row in self._load_rows():
+            if row.get("tutorial") and row["name"] == carryname:
+                return self._carry_from_row(row)
+        return None
+
+    def load_book_data(self, timeout=None):
+        return self.get_carries()
+
+    def update_value_in_table(self, carryname):
+        with self._lock:
+            rows = self._load_rows()
+            for row in rows:
+                if row["name"] == carryname:
+                    row["tutorial"] = True
+                    self.save_carry_rows(rows)
+                    print(f"Successfully updated tutorial to True")
+                    return
+        print(f"Error updating value: carry {carryname} not found")
+
+    def list_bucket(self):
+        """
+        List the step directory the way the storage API lists a bucket.
+
+        Returns:
+            list: File entries with name, updated_at and metadata
+        """
+        try:
+            entries = sorted(os.scandir(self.steps_dir), key=lambda e: e.name)
+        except FileNotFoundError:
+            return []
+
+        files = []
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith("."):
+                continue
+            stat = entry.stat()
+            files.append(
+                {
+                    "name": entry.name,
+                    "updated_at": str(stat.st_mtime_ns),
+                    "metadata": {
+                        "size": stat.st_size,
+                        "eTag": f"{stat.st_size}-{stat.st_mtime_ns}",
+                    },
+                }
+            )
+        return files
+
+    def upload_png_data(self, file_name, data):
+        """
+        Store PNG data in the step directory, failing if the file exists.
+
+        Args:
+            file_name (str): Name of the file in the bucket
+            data (bytes): PNG data
+        """
+        os.makedirs(self.steps_dir, exist_ok=True)
+        print(f"Uploading {file_name}...")
+        with open(os.path.join(self.steps_dir, file_name), "xb") as f:
+            f.write(data)
+        self._manifest = None
+        print(f"Uploaded {file_name}")
+
+    def get_bucket_manifest(self, refresh=False):
+        """
+        Get the step directory contents indexed by carry name.
+
+        Args:
+            refresh (bool): List the directory again even if a manifest exists
+
+        Returns:
+            dict: Same shape as db_utils.get_bucket_manifest
+        """
+        if self._manifest is None or refresh:
+            self._manifest = db_utils._build_manifest(self.list_bucket())
+        return self._manifest
+
+    def get_signed_urls(self, file_names):
+        """
+        Get file:// URLs for files in the step directory, which need no signing.
+
+        Args:
+            file_names (list): Names of the files
+
+        Returns:
+            dict: File name mapped to its URL, for files that exist
+        """
+        urls = {}
+        for file_name in file_names:
+            path = pathlib.Path(self.steps_dir, file_name).resolve()
+            if path.is_file():
+                urls[file_name] = path.as_uri()
+        return urls
+
+    def get_tutorial_steps_by_carry(self, name_filter):
+        """
+        Gets the tutorial step images of a carry from the step directory
+
+        Args:
+            name_filter (str): Name of the carry, steps are named {name_filter}_stepNN
+
+        Returns:
+            dict: Same shape as db_utils.get_tutorial_steps_by_carry, with
+                file:// URLs
+        """
+        manifest = self.get_bucket_manifest()
+
+        if not manifest:
+            return {"data": None, "error": "No files found or error listing files"}
+
+        files = manifest.get(name_filter, [])
+        urls = self.get_signed_urls([file["name"] for file in files])
+
+        image_files = []
+        for file in files:
+            if file["name"] in urls:
+                image_files.append(
+                    {
+                        "name": file["name"],
+                        "url": urls[file["name"]],
+                        "version": file["metadata"]["eTag"],
+                    }
+                )
+
+        return {"data": image_files, "error": None}
@@ -40,6 +40,7 @@ class PostGenerator(BaseContentGenerator.BaseContentGenerator):
 
         c.save()
         print(f"Post PDF successfully created: {output_full_path}")
+        self._report_build_stats()
 
         # Convert pdf to pngs
         image_utils.pdf_to_pngs(output_full_path, self.output_dir)
@@ -100,33 +101,48 @@ class PostGenerator(BaseContentGenerator.BaseContentGenerator):
             bool: True if pages were created successfully, False otherwise
         """
         # Get images from bucket
-        results = db_utils.get_tutorial_steps_by_carry(self.carry.name)["data"]
-        urls = [step["url"] for step in results]
+        steps = db_utils.get_tutorial_steps_by_carry(self.carry.name)["data"]
 
         # Calculate page layout
-        num_pages = self._calculate_pages_needed(urls)
+        num_pages = self._calculate_pages_needed(steps)
         image_width, image_height, gap_x = self._calculate_grid_layout()
 
-        # Create pages with grid layout
-        for page_index in range(num_pages):
-            self.page += 1
-            c.showPage()
-            self._create_tutorial_grid_page(
-                c, urls, page_index, self.carry, image_width, image_height, gap_x
-            )
-            # Draw header and footer
-            self._draw_page_header(c, self.carry, self.height - self.margin)
-            self._draw_page_footer(c)
+        # Create pages with grid layout, downloading ahead of drawing
+        with self._prefetch_images(steps, (image_width, image_height)) as images:
+            for page_index in range(num_pages):
+                self.page += 1
+                c.showPage()
+                self._create_tutorial_grid_page(
+                    c, images, page_index, self.carry, image_width, image_height, gap_x
+                )
+                # Draw header and footer
+                self._draw_page_header(c, self.carry, self.height - self.margin)
+                self._draw_page_footer(c)
 
     def _draw_page_header(self, c, carry, line_y):
         """
         Draw the page header with title, finish text and horizontal line
 
+        Everything but the page number is the same on every tutorial page, so
+        it is stamped from a form recorded on the first page.
+
         Args:
             c (canvas): The ReportLab canvas to draw on
             carry: Object containing carry information
             line_y: Y-position for the horizontal line
         """
+        self._stamp_form(
+            c,
+            "PostHeader",
+            lambda c: self._draw_page_header_content(c, carry, line_y),
+        )
+
+        page_number_y = self.height - 55
+        c.setFillColor(colors_utils.BACKPOSTLINE)
+        self._set_font(c, "AndaleMono", 32)
+        c.drawCentredString(self.width / 2, page_number_y, f"{self.page:02}")
+
+    def _draw_page_header_content(self, c, carry, line_y):
         # Draw horizontal line at the top
         # line = HorizontalLine(width=self.width - self.margin, thickness=1)
         # line.drawOn(c, self.margin / 2, line_y)
@@ -137,7 +153,7 @@ class PostGenerator(BaseContentGenerator.BaseContentGenerator):
         header_font_size = 14
 
         # Set font and draw header text
-        c.setFont(header_font, header_font_size)
+        self._set_font(c, header_font, header_font_size)
         c.setFillColor(colors_utils.BACKPOSTLINE)
         c.drawString(self.margin / 2, header_y, carry.title)  # Left-aligned title
         c.drawRightString(
@@ -155,18 +171,16 @@ class PostGenerator(BaseContentGenerator.BaseContentGenerator):
             c, self.width / 2 + self.margin / 2, self.height - self.margin / 1.5
         )
 
-        page_number_y = self.height - 55
-        c.setFillColor(colors_utils.BACKPOSTLINE)
-        c.setFont("AndaleMono", 32)
-        c.drawCentredString(self.width / 2, page_number_y, f"{self.page:02}")
-
     def _draw_page_footer(self, c):
         """
-        Draw the page footer with page number and horizontal line
+        Draw the page footer with signature and horizontal line
 
         Args:
             c (canvas): The ReportLab canvas to draw on
         """
+        self._stamp_form(c, "PostFooter", self._draw_page_footer_content)
+
+    def _draw_page_footer_content(self, c):
         # Calculate positions
         line_y = 0.75 * self.margin
 
@@ -177,7 +191,7 @@ class PostGenerator(BaseContentGenerator.BaseContentGenerator):
         line.drawOn(c, self.width / 2 - self.margin, line_y)
 
         # Draw signature
-        c.setFont("Poppins-Light", 12)
+        self._set_font(c, "Poppins-Light", 12)
         c.setFillColor(colors_utils.BACKPOSTLINE)
         c.drawCentredString(self.width / 2, line_y - 16, SIGNATURE)
 
@@ -195,17 +209,17 @@ class PostGenerator(BaseContentGenerator.BaseContentGenerator):
             insta_handle_y = line_y + 36
             author_y = line_y + 12
 
-            c.setFont("Poppins-Regular", 18)
+            self._set_font(c, "Poppins-Regular", 18)
             c.setFillColor(colors_utils.LIGHTBLACK)
             c.drawString(self.margin, insta_handle_y, signature)
 
-            c.setFont("Poppins-Regular", 14)
+            self._set_font(c, "Poppins-Regular", 14)
             c.setFillColor(colors_utils.LIGHTBLACK)
             c.drawString(self.margin, author_y, f"based on video tutorials by {author}")
         else:
             insta_handle_y = line_y + 12
 
-            c.setFont("Poppins-Light", 18)
+            self._set_font(c, "Poppins-Light", 18)
             c.setFillColor(colors_utils.LIGHTBLACK)
             c.drawString(self.margin, insta_handle_y, signature)
 
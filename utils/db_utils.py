@@ -1,25 +1,196 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 from decouple import config
-from supabase import create_client, Client
 from utils import data_utils
+import functools
+import inspect
 import mimetypes
 import os
+import re
+import threading
+import time
 
-SUPABASE_URL = config("SUPABASE_URL")
-SUPABASE_KEY = config("SERVICE_ROLE_KEY")
-SUPABASE_CARRY_TABLE = config("SUPABASE_CARRY_TABLE")
-SUPABASE_RATING_TABLE = config("SUPABASE_RATING_TABLE")
-SUPABASE_BUCKET = config("SUPABASE_BUCKET")
+# "supabase", or "local" to read and write a snapshot in LOCAL_STORAGE_DIR
+STORAGE_BACKEND = config("STORAGE_BACKEND", default="supabase")
+LOCAL_STORAGE_DIR = config("LOCAL_STORAGE_DIR", default="storage")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Created by get_client on first use, so importing this module stays cheap
+_client = None
+_client_lock = threading.Lock()
+
+# Created by get_storage on first use when the local backend is selected
+_storage = None
+
+# Names of the functions that make up the storage interface, see _dispatch
+STORAGE_INTERFACE = set()
+
+# Threads running blocking client calls, created by _get_executor on first use
+_executor = None
 
 COLUMNS = ["name", "longtitle", "position", "size", "mmposition", "difficulty"]
 
+LIST_PAGE_SIZE = 1000
+STEP_FILENAME = re.compile(r"^(?P<carry>.+)_step(?P<step>\d+)\.[^.]+$")
+
+SIGNED_URL_EXPIRY = 3600
+SIGNED_URL_MARGIN = 300  # Re-sign URLs this many seconds before they expire
+SIGNED_URL_CHUNK = 100
+
+DB_TIMEOUT = config("DB_TIMEOUT", default=30, cast=float)  # Seconds per request
+DB_CONCURRENCY = config("DB_CONCURRENCY", default=4, cast=int)
+
+UPLOAD_WORKERS = config("UPLOAD_WORKERS", default=4, cast=int)
+UPLOAD_RETRIES = 3
+UPLOAD_BACKOFF = 1.0  # Seconds before the first retry, doubled on each attempt
+
+# Bucket manifest, built once per process by get_bucket_manifest
+_manifest = None
+
+# Signed URLs by file name, as (url, expires_at)
+_signed_urls = {}
+
+
+def get_client():
+    """
+    Get the Supabase client, creating it on first use.
+
+    The supabase package and the connection settings are only loaded here, so
+    code paths that never reach the database do not pay for them.
+
+    Returns:
+        Client: Supabase client shared by the whole process
+    """
+    global _client
+    if STORAGE_BACKEND == "local":
+        # Every storage call must go through _dispatch to the local storage
+        raise RuntimeError(
+            "The Supabase client was requested with STORAGE_BACKEND=local"
+        )
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from supabase import ClientOptions, create_client
+
+                # A hung request fails after DB_TIMEOUT rather than holding
+                # its thread, and the process exit, for as long as it lasts
+                _client = create_client(
+                    config("SUPABASE_URL"),
+                    config("SERVICE_ROLE_KEY"),
+                    options=ClientOptions(
+                        postgrest_client_timeout=DB_TIMEOUT,
+                        storage_client_timeout=DB_TIMEOUT,
+                    ),
+                )
+    return _client
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _client_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=max(1, DB_CONCURRENCY) + 2, thread_name_prefix="db"
+                )
+    return _executor
+
+
+def _reset_after_fork():
+    # The executor's threads do not exist in a forked worker, and the client's
+    # pooled connections must not be shared with it
+    global _client, _executor, _client_lock
+    _client = None
+    _executor = None
+    _client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_storage():
+    """
+    Get the local storage when STORAGE_BACKEND is "local".
 
+    Returns:
+        LocalStorage: Storage over LOCAL_STORAGE_DIR, or None for Supabase
+
+    Raises:
+        NotImplementedError: If LocalStorage lacks part of STORAGE_INTERFACE
+    """
+    global _storage
+    if STORAGE_BACKEND == "supabase":
+        return None
+    if STORAGE_BACKEND != "local":
+        raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}")
+
+    if _storage is None:
+        with _client_lock:
+            if _storage is None:
+                from utils import LocalStorage
+
+                storage = LocalStorage.LocalStorage(LOCAL_STORAGE_DIR)
+                missing = sorted(
+                    name
+                    for name in STORAGE_INTERFACE
+                    if not callable(getattr(storage, name, None))
+                )
+                if missing:
+                    raise NotImplementedError(
+                        f"LocalStorage does not implement {', '.join(missing)}"
+                    )
+                _storage = storage
+    return _storage
+
+
+def _dispatch(func):
+    """
+    Make a function part of the storage interface.
+
+    When the local storage is selected, calls go to its method of the same
+    name, without the _async suffix for coroutines, which return the result
+    of the synchronous method. get_storage checks that LocalStorage has every
+    such method, and get_client refuses to connect to Supabase, so no call
+    reaches the network with STORAGE_BACKEND=local.
+    """
+    name = func.__name__.removesuffix("_async")
+    STORAGE_INTERFACE.add(name)
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            storage = get_storage()
+            if storage is not None:
+                return getattr(storage, name)(*args, **kwargs)
+            return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        storage = get_storage()
+        if storage is not None:
+            return getattr(storage, name)(*args, **kwargs)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _carry_table():
+    return get_client().table(config("SUPABASE_CARRY_TABLE"))
+
+
+def _bucket():
+    return get_client().storage.from_(config("SUPABASE_BUCKET"))
+
+
+@_dispatch
 def update_value_in_table(carryname):
     try:
         # Perform the update on the table
         response = (
-            supabase.table(SUPABASE_CARRY_TABLE)
+            _carry_table()
             .update({"tutorial": True})  # Column to update and its new value
             .eq("name", carryname)
             .execute()
@@ -34,155 +205,471 @@ def update_value_in_table(carryname):
         print(f"Error updating value: {e}")
 
 
-def upload_png_files(file_paths):
-    storage = supabase.storage.from_(SUPABASE_BUCKET)
+def _is_transient(error):
+    """Client errors will fail again on retry, except timeouts and rate limits."""
+    try:
+        status = int(getattr(error, "status", None))
+    except (TypeError, ValueError):
+        return True
+    return status in (408, 429) or status >= 500
 
-    for file_path in file_paths:
-        file_name = os.path.basename(file_path)
 
-        # Check if file already exists
+@_dispatch
+def upload_png_data(file_name, data):
+    """
+    Upload PNG data, retrying with exponential backoff on transient errors.
+
+    Args:
+        file_name (str): Name of the file in the bucket
+        data (bytes): PNG data
+    """
+    storage = _bucket()
+
+    for attempt in range(UPLOAD_RETRIES + 1):
         try:
-            existing_files = storage.list(
-                "", {"limit": 1000}
-            )  # Or use a folder path if needed
-            existing_names = [item["name"] for item in existing_files]
-
-            if file_name in existing_names:
-                print(f"Skipped {file_name} (already exists)")
-                continue
+            print(f"Uploading {file_name}...")
+            storage.upload(
+                path=file_name,
+                file=data,
+                file_options={"content-type": "image/png", "upsert": "false"},
+            )
+            print(f"Uploaded {file_name}")
+            return
         except Exception as e:
-            print(f"Error checking {file_name}: {e}")
-            continue
+            if attempt == UPLOAD_RETRIES or not _is_transient(e):
+                raise
+            delay = UPLOAD_BACKOFF * 2**attempt
+            print(f"Retrying {file_name} in {delay:.0f}s: {e}")
+            time.sleep(delay)
+
+
+def _upload_file(file_path):
+    with open(file_path, "rb") as f:
+        upload_png_data(os.path.basename(file_path), f.read())
+
+
+def upload_png_files(file_paths, max_workers=UPLOAD_WORKERS):
+    """
+    Upload PNG files to the bucket, skipping files that already exist.
+
+    The bucket is listed once up front, then the remaining files are uploaded
+    concurrently.
+
+    Args:
+        file_paths (list): Paths of the PNG files to upload
+        max_workers (int): Number of concurrent uploads
+
+    Returns:
+        dict: Lists of file names that were uploaded, skipped and failed
+    """
+    global _manifest
+
+    summary = {"uploaded": [], "skipped": [], "failed": []}
 
-        # Upload file
-        with open(file_path, "rb") as f:
+    # Check which files already exist
+    try:
+        existing_names = {item["name"] for item in list_bucket()}
+    except Exception as e:
+        print(f"Error listing bucket: {e}")
+        summary["failed"] = [os.path.basename(path) for path in file_paths]
+        return summary
+
+    to_upload = []
+    for file_path in file_paths:
+        file_name = os.path.basename(file_path)
+        if file_name in existing_names:
+            print(f"Skipped {file_name} (already exists)")
+            summary["skipped"].append(file_name)
+        else:
+            to_upload.append(file_path)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [
+            (os.path.basename(path), executor.submit(_upload_file, path))
+            for path in to_upload
+        ]
+        for file_name, future in futures:
             try:
-                print(f"Uploading {file_name}...")
-                storage.upload(
-                    path=file_name,
-                    file=f,
-                    file_options={"content-type": "image/png", "upsert": "false"},
-                )
-                print(f"Uploaded {file_name}")
+                future.result()
+                summary["uploaded"].append(file_name)
             except Exception as e:
                 print(f"Failed to upload {file_name}: {e}")
+                summary["failed"].append(file_name)
 
+    # The bucket changed, list it again next time it is needed
+    if summary["uploaded"]:
+        _manifest = None
+
+    print(
+        f"Uploaded {len(summary['uploaded'])}, skipped {len(summary['skipped'])}, "
+        f"failed {len(summary['failed'])}"
+    )
+    return summary
+
+
+def _carry_from_row(r):
+    return data_utils.Carry(
+        r["name"],
+        r["longtitle"],
+        r["mmposition"],
+        r["position"],
+        r["size"],
+        r["wrappinggallery_rating"]["difficulty"],
+    )
 
-def get_carries():
-    main_table_columns = ",".join(COLUMNS)
 
-    response = (
-        supabase.table(SUPABASE_CARRY_TABLE)
-        .select(
-            f"""
+def _carries_query():
+    rating_table = config("SUPABASE_RATING_TABLE")
+
+    return _carry_table().select(f"""
             name, 
             longtitle, 
             position, 
             size, 
             mmposition,
-            {SUPABASE_RATING_TABLE}(difficulty)
-        """
-        )
-        .eq("tutorial", True)
-        .execute()
+            {rating_table}(difficulty)
+        """).eq("tutorial", True)
+
+
+async def _call(func, *args, **kwargs):
+    """
+    Run a blocking client call in a worker thread, giving up after DB_TIMEOUT.
+
+    The Supabase client is synchronous, so calls made concurrently each get a
+    thread. A call that times out or is cancelled stops being waited for; the
+    request itself finishes in the background. The threads belong to this
+    module rather than to asyncio's default executor, which asyncio.run waits
+    for on exit, so synchronous wrappers also return after DB_TIMEOUT.
+    """
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(
+        loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs)),
+        DB_TIMEOUT,
     )
 
-    carries = [
-        data_utils.Carry(
-            r["name"],
-            r["longtitle"],
-            r["mmposition"],
-            r["position"],
-            r["size"],
-            r["wrappinggallery_rating"]["difficulty"],
-        )
+
+async def _gather(*coroutines):
+    """
+    Run coroutines concurrently, cancelling the rest as soon as one fails.
+
+    Returns:
+        list: Their results, in order
+    """
+    try:
+        async with asyncio.TaskGroup() as group:
+            tasks = [group.create_task(coroutine) for coroutine in coroutines]
+    except ExceptionGroup as e:
+        # Surface the error itself rather than the group wrapping it
+        raise e.exceptions[0]
+    return [task.result() for task in tasks]
+
+
+def _run(coroutine):
+    """Run a coroutine of this module to completion for a synchronous caller."""
+    return asyncio.run(coroutine)
+
+
+@_dispatch
+async def get_carries_async():
+    """
+    Get every carry that has a tutorial, with its difficulty rating.
+
+    Returns:
+        list: Carry objects
+    """
+    response = await _call(_carries_query().execute)
+    return [_carry_from_row(r) for r in response.data]
+
+
+@_dispatch
+async def get_carry_rows_async():
+    """
+    Get every carry that has a tutorial as plain rows, e.g. to store locally.
+
+    Returns:
+        list: Dicts with the carry columns, its difficulty and tutorial flag,
+            in the format of LocalStorage's carries.json
+    """
+    response = await _call(_carries_query().execute)
+    return [
+        {
+            "name": r["name"],
+            "longtitle": r["longtitle"],
+            "mmposition": r["mmposition"],
+            "position": r["position"],
+            "size": r["size"],
+            "difficulty": r["wrappinggallery_rating"]["difficulty"],
+            "tutorial": True,
+        }
         for r in response.data
     ]
 
-    return carries
 
+@_dispatch
+async def get_snapshot_async():
+    """
+    Fetch the carry rows and the bucket listing concurrently.
 
-def get_carry_by_name(carryname):
-    main_table_columns = ",".join(COLUMNS)
+    Returns:
+        tuple: (rows as returned by get_carry_rows_async, bucket file entries)
+    """
+    rows, files = await _gather(get_carry_rows_async(), list_bucket_async())
+    return rows, files
 
-    response = (
-        supabase.table(SUPABASE_CARRY_TABLE)
-        .select(
-            f"""
-            name, 
-            longtitle, 
-            position, 
-            size, 
-            mmposition,
-            {SUPABASE_RATING_TABLE}(difficulty)
-        """
-        )
-        .eq("tutorial", True)
-        .eq("name", carryname)
-        .limit(1)
-        .execute()
-    )
+
+@_dispatch
+def get_carries():
+    """Synchronous version of get_carries_async."""
+    return _run(get_carries_async())
+
+
+@_dispatch
+async def get_carry_by_name_async(carryname):
+    """
+    Get a carry that has a tutorial by its name.
+
+    Args:
+        carryname (str): Name of the carry
+
+    Returns:
+        Carry: The carry, or None if there is no such carry with a tutorial
+    """
+    response = await _call(_carries_query().eq("name", carryname).limit(1).execute)
 
     if not response.data:
         return None  # or raise an exception if preferred
 
-    r = response.data[0]
-    return data_utils.Carry(
-        r["name"],
-        r["longtitle"],
-        r["mmposition"],
-        r["position"],
-        r["size"],
-        r["wrappinggallery_rating"]["difficulty"],
+    return _carry_from_row(response.data[0])
+
+
+@_dispatch
+def get_carry_by_name(carryname):
+    """Synchronous version of get_carry_by_name_async."""
+    return _run(get_carry_by_name_async(carryname))
+
+
+@_dispatch
+async def list_bucket_async():
+    """
+    List every file in the storage bucket, following pagination.
+
+    Returns:
+        list: File entries as returned by the storage API
+    """
+    storage = _bucket()
+
+    files = []
+    offset = 0
+    while True:
+        page = await _call(
+            storage.list,
+            "",
+            {
+                "limit": LIST_PAGE_SIZE,
+                "offset": offset,
+                "sortBy": {"column": "name", "order": "asc"},
+            },
+        )
+        files.extend(page)
+        if len(page) < LIST_PAGE_SIZE:
+            return files
+        offset += LIST_PAGE_SIZE
+
+
+@_dispatch
+def list_bucket():
+    """Synchronous version of list_bucket_async."""
+    return _run(list_bucket_async())
+
+
+def _build_manifest(files):
+    steps_by_carry = {}
+    for file in files:
+        file_name = file.get("name")
+        if not file_name:
+            continue
+
+        # Only image files named {carryname}_stepNN are tutorial steps
+        mime_type, _ = mimetypes.guess_type(file_name)
+        match = STEP_FILENAME.match(file_name)
+        if not (mime_type and mime_type.startswith("image/") and match):
+            continue
+
+        steps_by_carry.setdefault(match.group("carry"), []).append(
+            (int(match.group("step")), file)
+        )
+
+    return {
+        carry: [file for _, file in sorted(steps, key=lambda step: step[0])]
+        for carry, steps in steps_by_carry.items()
+    }
+
+
+@_dispatch
+async def get_bucket_manifest_async(refresh=False):
+    """
+    Get the bucket contents indexed by carry name.
+
+    The bucket is listed once and the result kept for the rest of the process,
+    so looking up the steps of a carry does not hit the network again.
+
+    Args:
+        refresh (bool): List the bucket again even if a manifest exists
+
+    Returns:
+        dict: Carry name mapped to its step files, ordered by step number
+    """
+    global _manifest
+
+    if _manifest is None or refresh:
+        _manifest = _build_manifest(await list_bucket_async())
+
+    return _manifest
+
+
+def get_bucket_manifest(refresh=False):
+    """Synchronous version of get_bucket_manifest_async."""
+    return _run(get_bucket_manifest_async(refresh))
+
+
+@_dispatch
+async def get_signed_urls_async(file_names):
+    """
+    Get signed URLs for files in the bucket, signing in concurrent batches.
+
+    URLs are cached with their expiry time. Only files without a URL, or whose
+    URL expires within SIGNED_URL_MARGIN seconds, are sent to the storage API,
+    SIGNED_URL_CHUNK paths per request and up to DB_CONCURRENCY requests at a
+    time.
+
+    Args:
+        file_names (list): Names of the files in the bucket
+
+    Returns:
+        dict: File name mapped to its signed URL, for files that could be signed
+    """
+    now = time.time()
+    stale = [
+        file_name
+        for file_name in file_names
+        if file_name not in _signed_urls
+        or _signed_urls[file_name][1] - SIGNED_URL_MARGIN <= now
+    ]
+
+    storage = _bucket()
+    limit = asyncio.Semaphore(DB_CONCURRENCY)
+
+    async def sign(chunk):
+        async with limit:
+            # Take the time before the request so the expiry is never overestimated
+            expires_at = time.time() + SIGNED_URL_EXPIRY
+            response = await _call(
+                storage.create_signed_urls, chunk, expires_in=SIGNED_URL_EXPIRY
+            )
+        for item in response:
+            if item.get("signedURL") and not item.get("error"):
+                _signed_urls[item["path"]] = (item["signedURL"], expires_at)
+
+    await _gather(
+        *(
+            sign(stale[i : i + SIGNED_URL_CHUNK])
+            for i in range(0, len(stale), SIGNED_URL_CHUNK)
+        )
     )
 
+    return {
+        file_name: _signed_urls[file_name][0]
+        for file_name in file_names
+        if file_name in _signed_urls
+    }
 
-def get_tutorial_steps_by_carry(name_filter):
+
+def get_signed_urls(file_names):
+    """Synchronous version of get_signed_urls_async."""
+    return _run(get_signed_urls_async(file_names))
+
+
+async def _sign_manifest(manifest):
+    # Sign every step in the bucket up front, later carries reuse the URLs
+    if not _signed_urls:
+        await get_signed_urls_async(
+            [file["name"] for files in manifest.values() for file in files]
+        )
+
+
+@_dispatch
+async def get_tutorial_steps_by_carry_async(name_filter):
     """
-    Gets images from a Supabase storage bucket where filename contains a specific string
+    Gets the tutorial step images of a carry from the Supabase storage bucket
 
     Args:
-        name_filter (str): String to filter filenames by (will match if filename contains this string)
-        folder_path (str, optional): Optional folder path within the bucket. Defaults to "".
+        name_filter (str): Name of the carry, steps are named {name_filter}_stepNN
 
     Returns:
         dict: Dictionary containing list of images with their data and URLs, or error message
     """
     try:
-        # List all files in the specified bucket and folder
-        response = supabase.storage.from_(SUPABASE_BUCKET).list("", {"limit": 1000})
+        manifest = await get_bucket_manifest_async()
 
-        if not response:
+        if not manifest:
             return {"data": None, "error": "No files found or error listing files"}
 
-        # Filter for image files
+        await _sign_manifest(manifest)
+
+        files = manifest.get(name_filter, [])
+        signed_urls = await get_signed_urls_async([file["name"] for file in files])
+
         image_files = []
-        for file in response:
-            file_name = file.get("name")
-            if file_name:
-                # Prepare strings for comparison based on case sensitivity setting
-
-                # Check if file is an image and name contains the filter string
-                mime_type, _ = mimetypes.guess_type(file_name)
-                if (
-                    mime_type
-                    and mime_type.startswith("image/")
-                    and file_name.startswith(name_filter + "_step")
-                ):
-                    # Generate public URL for the image
-                    signed_url_response = supabase.storage.from_(
-                        SUPABASE_BUCKET
-                    ).create_signed_url(file_name, expires_in=3600)
-
-                    if "signedURL" in signed_url_response:
-                        image_files.append(
-                            {
-                                "name": file_name,
-                                "url": signed_url_response["signedURL"],
-                            }
-                        )
+        for file in files:
+            file_name = file["name"]
+            if file_name in signed_urls:
+                metadata = file.get("metadata") or {}
+                image_files.append(
+                    {
+                        "name": file_name,
+                        "url": signed_urls[file_name],
+                        "version": metadata.get("eTag") or file.get("updated_at"),
+                    }
+                )
 
         return {"data": image_files, "error": None}
 
     except Exception as e:
         return {"data": None, "error": str(e)}
+
+
+@_dispatch
+def get_tutorial_steps_by_carry(name_filter):
+    """Synchronous version of get_tutorial_steps_by_carry_async."""
+    return _run(get_tutorial_steps_by_carry_async(name_filter))
+
+
+@_dispatch
+async def load_book_data_async(timeout=None):
+    """
+    Fetch everything a book build needs from Supabase concurrently.
+
+    The carries query and the bucket listing run at the same time, then every
+    step is signed in concurrent batches. Steps are kept in the manifest and
+    signed URL caches, so get_tutorial_steps_by_carry answers from memory
+    afterwards. If any request fails the others are cancelled.
+
+    Args:
+        timeout (float, optional): Seconds the whole fetch may take
+
+    Returns:
+        list: Carry objects
+    """
+    async with asyncio.timeout(timeout):
+        carries, manifest = await _gather(
+            get_carries_async(), get_bucket_manifest_async()
+        )
+        await _sign_manifest(manifest)
+
+    return carries
+
+
+@_dispatch
+def load_book_data(timeout=None):
+    """Synchronous version of load_book_data_async."""
+    return _run(load_book_data_async(timeout))
@@ -1,3 +1,7 @@
+import threading
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
 # Font configuration
 FONTCONFIG = [
     {
@@ -17,3 +21,44 @@ FONTCONFIG = [
     },
     {"name": "AndaleMono", "path": "fonts/ANDALEMO.TTF"},
 ]
+
+_FONT_PATHS = {font["name"]: font["path"] for font in FONTCONFIG}
+_registered = set()
+_failed = set()
+_lock = threading.Lock()
+
+
+def register_font(font_name):
+    """
+    Register a font from FONTCONFIG with ReportLab the first time it is used.
+
+    Registered fonts live in ReportLab's process-wide registry, so each TTF file
+    is parsed at most once per process no matter how many generators or
+    threads use it. Names not listed in FONTCONFIG, such as the standard PDF
+    fonts, are left to ReportLab.
+
+    Parameters:
+    - font_name: str, name of the font as listed in FONTCONFIG
+
+    Returns:
+    - bool, True if the font can be used, False if registering it failed
+    """
+    if font_name in _registered or font_name not in _FONT_PATHS:
+        return True
+    if font_name in _failed:
+        return False
+
+    with _lock:
+        # Another thread may have registered it while we waited
+        if font_name in _registered or font_name in _failed:
+            return font_name in _registered
+
+        try:
+            pdfmetrics.registerFont(TTFont(font_name, _FONT_PATHS[font_name]))
+        except Exception as e:
+            print(f"Failed to register font {font_name}: {e}")
+            _failed.add(font_name)
+            return False
+
+        _registered.add(font_name)
+        return True
@@ -0,0 +1,276 @@
+from decouple import config
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib.request import url2pathname
+
+HTTP_POOL_SIZE = config("HTTP_POOL_SIZE", default=16, cast=int)
+HTTP_MAX_CONCURRENCY = config("HTTP_MAX_CONCURRENCY", default=16, cast=int)
+HTTP_RETRIES = config("HTTP_RETRIES", default=4, cast=int)
+HTTP_BACKOFF = config("HTTP_BACKOFF", default=0.5, cast=float)  # Seconds, doubled
+HTTP_TIMEOUT = config("HTTP_TIMEOUT", default=30, cast=float)
+
+# Statuses worth retrying, and that mean the server wants fewer requests
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class _FileAdapter(BaseAdapter):
+    """Serve file:// URLs from disk, so local snapshots use the same code path."""
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+
+        path = url2pathname(request.path_url.split("?", 1)[0])
+        try:
+            with open(path, "rb") as f:
+                response._content = f.read()
+            response.status_code = 200
+            response.headers["Content-Length"] = str(len(response._content))
+        except FileNotFoundError:
+            response._content = b""
+            response.status_code = 404
+        return response
+
+    def close(self):
+        pass
+
+
+def get_session():
+    """
+    Get the HTTP session shared by the whole process, creating it on first use.
+
+    The session keeps connections alive between requests, with up to
+    HTTP_POOL_SIZE pooled connections per host. file:// URLs are read from
+    disk.
+
+    Returns:
+        requests.Session: The shared session
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.mount("file://", _FileAdapter())
+                _session = session
+    return _session
+
+
+class _ConcurrencyLimit:
+    """
+    Bound the number of requests in flight, adapting to how the server copes.
+
+    The limit is halved whenever a request is throttled or fails on the server
+    side, and grows back by one after a full limit's worth of successes.
+    """
+
+    def __init__(self, maximum):
+        self.maximum = max(1, maximum)
+        self.limit = self.maximum
+        self.in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            elif self.limit < self.maximum:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+
+class _Stats:
+    """Counters for every request made through this module."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.retries = 0
+            self.throttled = 0
+            self.bytes = 0
+            self.latencies = []
+
+    def record(self, latency, size, retried, throttled):
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+            self.latencies.append(latency)
+            if retried:
+                self.retries += 1
+            if throttled:
+                self.throttled += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "bytes": self.bytes,
+                "latencies": list(self.latencies),
+            }
+
+    def add(self, stats):
+        with self._lock:
+            self.requests += stats["requests"]
+            self.retries += stats["retries"]
+            self.throttled += stats["throttled"]
+            self.bytes += stats["bytes"]
+            self.latencies.extend(stats["latencies"])
+
+
+_limit = _ConcurrencyLimit(HTTP_MAX_CONCURRENCY)
+_stats = _Stats()
+
+
+def _reset_after_fork():
+    # Pooled sockets and locks must not be shared with a forked worker
+    global _session, _session_lock, _limit, _stats
+    _session = None
+    _session_lock = threading.Lock()
+    _limit = _ConcurrencyLimit(HTTP_MAX_CONCURRENCY)
+    _stats = _Stats()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _backoff(attempt, response=None):
+    """Seconds to wait before a retry: Retry-After if given, else full jitter."""
+    if response is not None:
+        try:
+            return float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            pass
+    return random.uniform(0, HTTP_BACKOFF * 2**attempt)
+
+
+def get(url, headers=None, timeout=HTTP_TIMEOUT):
+    """
+    GET a URL through the shared session, retrying transient failures.
+
+    Connection errors, timeouts and RETRY_STATUSES responses are retried up to
+    HTTP_RETRIES times with jittered exponential backoff. Throttled or failed
+    requests also lower the number of requests allowed in flight.
+
+    Args:
+        url (str): URL to download
+        headers (dict, optional): Extra request headers
+        timeout (float): Seconds to wait for the server
+
+    Returns:
+        requests.Response: The last response; callers check its status
+    """
+    session = get_session()
+
+    for attempt in range(HTTP_RETRIES + 1):
+        _limit.acquire()
+        start = time.perf_counter()
+        response = None
+        try:
+            response = session.get(url, headers=headers, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == HTTP_RETRIES:
+                raise
+        finally:
+            throttled = response is None or response.status_code in RETRY_STATUSES
+            _limit.release(throttled)
+            _stats.record(
+                time.perf_counter() - start,
+                len(response.content) if response is not None else 0,
+                retried=attempt > 0,
+                throttled=throttled,
+            )
+
+        if not throttled or attempt == HTTP_RETRIES:
+            return response
+
+        time.sleep(_backoff(attempt, response))
+
+
+def get_stats():
+    """
+    Counters of the requests made so far, in a form that can cross processes.
+
+    Returns:
+        dict: Requests, retries, throttled requests, bytes and latencies
+    """
+    return _stats.snapshot()
+
+
+def stats_since(start):
+    """
+    Counters of the requests made since an earlier get_stats snapshot.
+
+    Args:
+        start (dict): Snapshot taken when e.g. a build started
+
+    Returns:
+        dict: Counters in the format of get_stats
+    """
+    stats = get_stats()
+    return {
+        "requests": stats["requests"] - start["requests"],
+        "retries": stats["retries"] - start["retries"],
+        "throttled": stats["throttled"] - start["throttled"],
+        "bytes": stats["bytes"] - start["bytes"],
+        # Latencies are only ever appended, the new ones are at the end
+        "latencies": stats["latencies"][len(start["latencies"]) :],
+    }
+
+
+def add_stats(stats):
+    """Add counters collected in another process, as returned by get_stats."""
+    _stats.add(stats)
+
+
+def report(stats=None):
+    """
+    Summarize requests in one line.
+
+    Args:
+        stats (dict, optional): Counters to summarize, e.g. from stats_since.
+            Defaults to every request made by this process so far
+    """
+    if stats is None:
+        stats = get_stats()
+    if not stats["requests"]:
+        return "HTTP: no requests"
+
+    latencies = sorted(stats["latencies"])
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+    return (
+        f"HTTP: {stats['requests']} requests ({stats['retries']} retries, "
+        f"{stats['throttled']} throttled), {stats['bytes'] / 1024 / 1024:.1f} MiB, "
+        f"latency p50 {p50:.0f} ms, p95 {p95:.0f} ms"
+    )
@@ -1,13 +1,16 @@
-from PIL import Image
+from PIL import Image, ImageChops, ImageOps
 from reportlab.lib.utils import ImageReader
 import re
-import cairosvg
+import functools
 import io
+import math
 import os
-from pdf2image import convert_from_path
+from xml.etree import ElementTree
 
 
 def pdf_to_pngs(pdf_path, output_folder="."):
+    from pdf2image import convert_from_path
+
     try:
         # Extract base name without extension
         base = os.path.splitext(os.path.basename(pdf_path))[0]
@@ -25,56 +28,246 @@ def pdf_to_pngs(pdf_path, output_folder="."):
         print("Failed to convert PDF to PNGs:", e)
 
 
-def transform_svg_cover(svg_path, target_color, init_color="ff0000"):
+def is_blank(image, tolerance=0):
+    """
+    Check whether an image is empty, i.e. every pixel is white or nearly white.
+
+    Uses the per-band extrema computed by PIL, so no pixel data is copied into
+    Python objects.
+
+    Parameters:
+    - image: PIL.Image to check
+    - tolerance: int, how far below 255 a band may go and still count as white
+
+    Returns:
+    - bool, True if the image has no content
+    """
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+
+    extrema = image.getextrema()
+    if image.mode == "L":
+        extrema = (extrema,)
+
+    return all(low >= 255 - tolerance for low, _ in extrema)
+
+
+def is_grayscale(image, tolerance=0):
+    """
+    Check whether an image only contains shades of gray.
+
+    Parameters:
+    - image: PIL.Image to check
+    - tolerance: int, how far apart the red, green and blue values of a pixel
+      may be for it to still count as gray
+
+    Returns:
+    - bool, True if the image can be stored as a single band without visible loss
+    """
+    if image.mode in ("1", "L", "LA", "I", "F"):
+        return True
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    red, green, blue = image.split()
+    return all(
+        ImageChops.difference(a, b).getextrema()[1] <= tolerance
+        for a, b in ((red, green), (green, blue))
+    )
+
+
+def _box_pixels(width, height, dpi):
+    return (
+        max(1, math.ceil(width / 72 * dpi)),
+        max(1, math.ceil(height / 72 * dpi)),
+    )
+
+
+def fits_box(image, width, height, dpi):
+    """
+    Check whether an image is no larger than a box printed at a given DPI.
+
+    Only the image header is needed, so this does not decode the pixel data.
+
+    Parameters:
+    - image: PIL.Image to check
+    - width: float, width of the box in points
+    - height: float, height of the box in points
+    - dpi: int, resolution the box will be printed at
+
+    Returns:
+    - bool, True if the image does not need to be downsampled
+    """
+    max_width, max_height = _box_pixels(width, height, dpi)
+    return image.width <= max_width and image.height <= max_height
+
+
+def fit_to_box(image, width, height, dpi):
+    """
+    Downsample an image so it does not exceed a box printed at a given DPI.
+
+    Images that are already small enough are returned unchanged; images are
+    never upsampled.
+
+    Parameters:
+    - image: PIL.Image to resize
+    - width: float, width of the box in points
+    - height: float, height of the box in points
+    - dpi: int, resolution the box will be printed at
+
+    Returns:
+    - PIL.Image, the resized image, keeping its aspect ratio
+    """
+    if fits_box(image, width, height, dpi):
+        return image
+
+    return ImageOps.contain(image, _box_pixels(width, height, dpi), Image.LANCZOS)
+
+
+# Size of SVG length units in CSS pixels, which is what cairosvg renders
+SVG_UNITS = {
+    "": 1,
+    "px": 1,
+    "pt": 4 / 3,
+    "pc": 16,
+    "mm": 96 / 25.4,
+    "cm": 96 / 2.54,
+    "in": 96,
+}
+
+COVER_DPI = 300
+
+
+def svg_size(svg_content):
+    """
+    Get the intrinsic size of an SVG document.
+
+    Parameters:
+    - svg_content: bytes, the SVG document
+
+    Returns:
+    - tuple, (width, height) in CSS pixels
+    """
+    root = ElementTree.fromstring(svg_content)
+
+    size = []
+    for attribute in ("width", "height"):
+        match = re.fullmatch(r"\s*([\d.]+)\s*([a-z]*)\s*", root.get(attribute, ""))
+        if match and match.group(2) in SVG_UNITS:
+            size.append(float(match.group(1)) * SVG_UNITS[match.group(2)])
+
+    if len(size) < 2:
+        _, _, width, height = (float(v) for v in root.get("viewBox").split())
+        size = [width, height]
+
+    return tuple(size)
+
+
+@functools.lru_cache(maxsize=64)
+def _render_svg_cover(svg_path, mtime, target_color, init_color, width, height, dpi):
+    """Recolor and rasterize an SVG file. Cached on path, mtime, color and size."""
+    try:
+        with open(svg_path, "rb") as f:
+            svg_content = f.read()
+    except FileNotFoundError:
+        raise FileNotFoundError(f"The file {svg_path} does not exist.")
+
+    # Replace the initial color with the target color
+    updated_content = svg_content.replace(init_color.encode(), target_color.encode())
+
+    output_width = output_height = None
+    if width is not None and height is not None:
+        # Fit the image in the box, preserving its aspect ratio
+        svg_width, svg_height = svg_size(updated_content)
+        ratio = min(width / svg_width, height / svg_height)
+        output_width = max(1, round(svg_width * ratio / 72 * dpi))
+        output_height = max(1, round(svg_height * ratio / 72 * dpi))
+
+    import cairosvg
+
+    png = cairosvg.svg2png(
+        bytestring=updated_content,
+        output_width=output_width,
+        output_height=output_height,
+        background_color=None,  # This ensures a transparent background
+    )
+
+    return ImageReader(io.BytesIO(png))
+
+
+def transform_svg_cover(
+    svg_path, target_color, init_color="ff0000", width=None, height=None, dpi=COVER_DPI
+):
     """
     Convert SVG file to PNG with transparent background.
 
+    Works in memory, and results are cached so drawing the same cover again
+    costs nothing.
+
     Parameters:
     - svg_path: str, path to input SVG file
     - target_color: str, target color to replace the initial color with
     - init_color: str, initial color to be replaced (default: "ff0000")
+    - width, height: float, box in points the image will be drawn in. If
+      given, the image is rendered at exactly the size needed at dpi,
+      otherwise at the SVG's own size
+    - dpi: int, resolution to render at when width and height are given
 
     Returns:
-    - PIL.Image object with transparent background
+    - ImageReader with transparent background
     """
     try:
-        with open(svg_path, "r", encoding="utf-8") as f:
-            svg_content = f.read()
+        mtime = os.path.getmtime(svg_path)
     except FileNotFoundError:
         raise FileNotFoundError(f"The file {svg_path} does not exist.")
 
-    # Replace the initial color with the target color
-    updated_content = svg_content.replace(init_color, target_color)
+    return _render_svg_cover(
+        svg_path, mtime, target_color, init_color, width, height, dpi
+    )
+
 
-    temp_svg = "temp.svg"
-    temp_png = "temp.png"
+@functools.lru_cache(maxsize=64)
+def _load_svg_cover_drawing(svg_path, mtime, target_color, init_color):
+    """Recolor an SVG file and convert it to a ReportLab drawing. Cached."""
     try:
-        with open(temp_svg, "w", encoding="utf-8") as f:
-            f.write(updated_content)
-
-        cairosvg.svg2png(
-            url=temp_svg,
-            write_to=temp_png,
-            output_width=None,
-            output_height=None,
-            scale=1.0,
-            background_color=None,  # This ensures a transparent background
+        from svglib.svglib import svg2rlg
+    except ImportError:
+        raise ImportError(
+            "Vector covers need svglib, install it with `uv sync --extra vector`"
         )
 
-        img = ImageReader(temp_png)
+    with open(svg_path, "rb") as f:
+        svg_content = f.read()
+
+    # Replace the initial color with the target color
+    updated_content = svg_content.replace(init_color.encode(), target_color.encode())
+
+    return svg2rlg(io.BytesIO(updated_content))
+
+
+def svg_cover_drawing(svg_path, target_color, init_color="ff0000"):
+    """
+    Convert SVG file to a ReportLab drawing, keeping it as vector graphics.
 
-    finally:
-        # Ensure the temporary file is removed even if an error occurs
-        if os.path.exists(temp_svg):
-            os.remove(temp_svg)
+    Parameters:
+    - svg_path: str, path to input SVG file
+    - target_color: str, target color to replace the initial color with
+    - init_color: str, initial color to be replaced (default: "ff0000")
 
-        if os.path.exists(temp_png):
-            os.remove(temp_png)
+    Returns:
+    - reportlab.graphics.shapes.Drawing, sized in points
+    """
+    try:
+        mtime = os.path.getmtime(svg_path)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"The file {svg_path} does not exist.")
 
-    return img
+    return _load_svg_cover_drawing(svg_path, mtime, target_color, init_color)
 
 
 def svg_to_pdf(input_svg, output_pdf):
+    import cairosvg
+
     try:
         cairosvg.svg2pdf(url=input_svg, write_to=output_pdf)
         print(f"Successfully converted '{input_svg}' to '{output_pdf}'")
@@ -1,15 +1,22 @@
-import os
+import functools
 import qrcode
-from utils import colors_utils
 
 
-# Data to be encoded
-def generate_qr(carryname):
+@functools.lru_cache(maxsize=None)
+def get_qr_matrix(carryname):
+    """
+    Get the modules of the QR code linking to a carry, including its border.
+
+    Args:
+        carryname (str): Name of the carry
+
+    Returns:
+        tuple: Rows of booleans, True for dark modules
+    """
     # Create QR code object
     qr = qrcode.QRCode(
         version=1,  # Controls the size of the QR code, 1 is the smallest
         error_correction=qrcode.constants.ERROR_CORRECT_L,  # Error correction level
-        box_size=10,  # Size of each box in the QR code grid
         border=4,  # Thickness of the border (minimum is 4)
     )
 
@@ -17,12 +24,4 @@ def generate_qr(carryname):
     qr.add_data(f"https//thewrappinggallery.com/carry/{carryname}")
     qr.make(fit=True)
 
-    # Create an image from the QR code
-    img = qr.make_image(fill=colors_utils.LIGHTBLACK, back_color="white")
-
-    # Save the image to a file
-    os.makedirs("qrcodes", exist_ok=True)
-    path = os.path.join("qrcodes", f"qrcode_{carryname}.png")
-    img.save(path)
-
-    return path
+    return tuple(tuple(row) for row in qr.get_matrix())